@@ -0,0 +1,17 @@
+import os.path as osp
+import sys
+
+
+def add_path(path):
+    # appended, the modules of exp/ (model, dataset, ...) keep precedence
+    if path not in sys.path:
+        sys.path.append(path)
+
+
+this_dir = osp.dirname(osp.abspath(__file__))
+lib_path = osp.join(this_dir, '..', 'lib')
+
+# helpers shared with the lib pipeline, one copy each in lib/
+add_path(osp.join(lib_path, 'model', 'utils'))      # spa_rasterizer
+add_path(osp.join(lib_path, 'roi_data_layer'))      # hoi_pairs, hoi_results
+add_path(osp.join(lib_path, 'datasets'))            # hico_eval
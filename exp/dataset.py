@@ -1,7 +1,8 @@
 import numpy as np
 
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, Sampler
+from torch.utils.data.dataloader import default_collate
 
 
 def bbox_trans(human_box_roi, object_box_roi, size=64):
@@ -90,6 +91,87 @@ def gen_spatial_map(human_box, object_box, obj_cls, num_obj_cls):
     return spa_map
 
 
+def bbox_trans_batch(human_boxes, object_boxes, size=64):
+    """Vectorized `bbox_trans` over (N,4) box arrays. Returns two (N,4) arrays of rounded coordinates."""
+    human_box = np.array(human_boxes).reshape(-1, 4)
+    object_box = np.array(object_boxes).reshape(-1, 4)
+    dtype = np.result_type(human_box.dtype, object_box.dtype)
+    if not np.issubdtype(dtype, np.floating):
+        dtype = np.float64
+    human_box = human_box.astype(dtype)
+    object_box = object_box.astype(dtype)
+
+    union_box = np.concatenate((np.minimum(human_box[:, :2], object_box[:, :2]),
+                                np.maximum(human_box[:, 2:], object_box[:, 2:])), axis=1)
+
+    height = union_box[:, 3] - union_box[:, 1] + 1
+    width = union_box[:, 2] - union_box[:, 0] + 1
+    ratio_height = height > width
+    scale = np.where(ratio_height, height, width)
+
+    # shift the top-left corner to (0,0)
+    human_box -= union_box[:, [0, 1, 0, 1]]
+    object_box -= union_box[:, [0, 1, 0, 1]]
+
+    # the longer side is mapped onto [0, size - 1]
+    x_max = np.where(ratio_height, size * width / height - 1, size - 1)
+    y_max = np.where(ratio_height, size - 1, size * height / width - 1)
+    for box in (human_box, object_box):
+        box[:, 0] = 0 + size * box[:, 0] / scale
+        box[:, 1] = 0 + size * box[:, 1] / scale
+        box[:, 2] = x_max - size * (width - 1 - box[:, 2]) / scale
+        box[:, 3] = y_max - size * (height - 1 - box[:, 3]) / scale
+
+    # center the shorter side
+    union_max = np.where(ratio_height,
+                         np.maximum(human_box[:, 2], object_box[:, 2]),
+                         np.maximum(human_box[:, 3], object_box[:, 3]))
+    shift = size / 2 - (union_max + 1) / 2
+
+    human_longer = np.where(ratio_height, human_box[:, 3] > object_box[:, 3], human_box[:, 2] > object_box[:, 2])
+    human_box[ratio_height & human_longer, 3] = size - 1
+    object_box[ratio_height & ~human_longer, 3] = size - 1
+    human_box[~ratio_height & human_longer, 2] = size - 1
+    object_box[~ratio_height & ~human_longer, 2] = size - 1
+
+    # bbox_trans adds the shift in float64 and only writes it back to the box dtype on the
+    # 'height' branch, so the rounding below has to follow the same precision per pair
+    shift_mask = np.where(ratio_height[:, np.newaxis], [1, 0, 1, 0], [0, 1, 0, 1])
+    outputs = []
+    for box in (human_box, object_box):
+        shifted = box.astype(np.float64) + shift_mask * shift.astype(np.float64)[:, np.newaxis]
+        outputs.append(np.where(ratio_height[:, np.newaxis],
+                                np.round(shifted.astype(dtype)),
+                                np.round(shifted)))
+    return outputs[0], outputs[1]
+
+
+def _slice_bounds(inds, size):
+    # python slice semantics: negative indices count from the end, then clip to [0, size]
+    inds = np.where(inds < 0, inds + size, inds)
+    return np.clip(inds, 0, size)
+
+
+def gen_spatial_maps_batch(hboxes, oboxes, size=64):
+    """Rasterize N human-object pairs into a (N,2,size,size) float32 array, identical to `gen_spatial_map`."""
+    hbox, obox = bbox_trans_batch(hboxes, oboxes, size)
+    boxes = np.stack((hbox, obox), axis=1).astype(np.int64)
+    coords = np.arange(size)
+
+    x1 = _slice_bounds(boxes[:, :, 0], size)[:, :, np.newaxis]
+    y1 = _slice_bounds(boxes[:, :, 1], size)[:, :, np.newaxis]
+    x2 = _slice_bounds(boxes[:, :, 2] + 1, size)[:, :, np.newaxis]
+    y2 = _slice_bounds(boxes[:, :, 3] + 1, size)[:, :, np.newaxis]
+    rows = (coords >= y1) & (coords < y2)
+    cols = (coords >= x1) & (coords < x2)
+    return (rows[:, :, :, np.newaxis] & cols[:, :, np.newaxis, :]).astype('float32')
+
+
+def pack_spatial_maps(spa_maps):
+    # (N,2,64,64) binary maps -> (N,2,64,8) uint8, 1 bit per pixel; see model.unpack_spatial_maps
+    return np.packbits(np.asarray(spa_maps) > 0, axis=-1)
+
+
 def gen_pose_feat(skeleton, obj_box):
 
     def is_inside_box(pt, box):
@@ -107,34 +189,245 @@ def gen_pose_feat(skeleton, obj_box):
     return pose_feat
 
 
+def skeletons_to_array(skeletons):
+    # list of 51-element lists (or None) -> (N,17,3) float32 keypoints and (N,) bool validity mask
+    skeleton_arr = np.zeros((len(skeletons), 17, 3), dtype='float32')
+    skeleton_valid = np.zeros(len(skeletons), dtype=bool)
+    for i, skeleton in enumerate(skeletons):
+        if skeleton is not None and isinstance(skeleton, list) and len(skeleton) == 51:
+            skeleton_arr[i] = np.array(skeleton).reshape(17, 3)
+            skeleton_valid[i] = True
+    return skeleton_arr, skeleton_valid
+
+
+def gen_pose_feats_batch(skeletons, oboxes, skeleton_valid=None):
+    """Vectorized `gen_pose_feat`: (N,17,3) keypoints and (N,4) object boxes -> (N,17) float32 inside-box flags."""
+    skeletons = np.asarray(skeletons).reshape(-1, 17, 3)
+    oboxes = np.asarray(oboxes).reshape(-1, 1, 4)
+    pose_x = skeletons[:, :, 0]
+    pose_y = skeletons[:, :, 1]
+    inside = (oboxes[:, :, 0] <= pose_x) & (pose_x <= oboxes[:, :, 2]) & \
+             (oboxes[:, :, 1] <= pose_y) & (pose_y <= oboxes[:, :, 3])
+    if skeleton_valid is not None:
+        inside &= np.asarray(skeleton_valid).reshape(-1, 1)
+    return inside.astype('float32')
+
+
+def class_ids_to_csr(class_ids):
+    # list of per-sample class id lists -> (M,) int16 class ids and (N+1,) int64 row offsets
+    lengths = np.array([len(ids) for ids in class_ids], dtype=np.int64)
+    offsets = np.zeros(len(class_ids) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    inds = np.array([ind for ids in class_ids for ind in ids], dtype=np.int16)
+    return inds, offsets
+
+
+def multi_hot_to_csr(multi_hot):
+    # (N,C) multi-hot rows -> the class_ids_to_csr layout
+    rows, inds = np.nonzero(multi_hot)
+    offsets = np.zeros(len(multi_hot) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(rows, minlength=len(multi_hot)))
+    return inds.astype(np.int16), offsets
+
+
+def gather_csr(inds, offsets, rows):
+    # (row in batch, class id) pairs of the selected rows
+    stts = offsets[rows]
+    lengths = offsets[rows + 1] - stts
+    batch_rows = np.repeat(np.arange(len(rows)), lengths)
+    positions = np.arange(lengths.sum()) + np.repeat(stts - (np.cumsum(lengths) - lengths), lengths)
+    return batch_rows, inds[positions]
+
+
 class HICODatasetSpa(Dataset):
 
-    def __init__(self, hoi_db):
+    def __init__(self, hoi_db, pack_spa_maps=False, spa_map_in_model=False):
 
         self.hboxes = hoi_db['hboxes']
         self.oboxes = hoi_db['oboxes']
         self.obj_classes = hoi_db['obj_classes']
-        self.hoi_classes = torch.from_numpy(hoi_db['hoi_classes']).float()
-        self.bin_classes = torch.from_numpy(hoi_db['bin_classes']).long()
-        self.spa_feats = torch.from_numpy(hoi_db['spa_feats']).float()
-        self.obj2vec = torch.from_numpy(hoi_db['obj2vec']).float()
-        self.skeletons = hoi_db['skeletons']
+        if 'hoi_class_inds' in hoi_db:
+            self.hoi_class_inds = hoi_db['hoi_class_inds']
+            self.hoi_class_offsets = hoi_db['hoi_class_offsets']
+        else:
+            # annotation caches built with dense multi-hot labels
+            self.hoi_class_inds, self.hoi_class_offsets = multi_hot_to_csr(hoi_db['hoi_classes'])
+        # per-sample columns may be read-only memmaps (see load_data.load_hoi_db), they are
+        # indexed per batch and never converted as a whole
+        self.bin_classes = hoi_db['bin_classes']
+        # image of every pair, HICOBatchSampler draws the negatives per image;
+        # None for annotation caches built without it
+        self.image_ids = hoi_db.get('image_ids')
+        self.spa_feats = hoi_db['spa_feats']
+        self.obj2vec = torch.from_numpy(np.array(hoi_db['obj2vec'])).float()
+        if isinstance(hoi_db['skeletons'], list):
+            # annotation caches built before skeletons were stored as arrays
+            self.skeletons, self.skeleton_valid = skeletons_to_array(hoi_db['skeletons'])
+        else:
+            self.skeletons = hoi_db['skeletons']
+            self.skeleton_valid = hoi_db['skeleton_valid']
         self.num_obj_class = 80
+        self.pack_spa_maps = pack_spa_maps
+        self.spa_map_in_model = spa_map_in_model
+
+        # precomputed maps are shared between DataLoader workers through the page cache
+        self.spa_maps = None
+        if 'spa_map_path' in hoi_db:
+            self.spa_maps = np.load(hoi_db['spa_map_path'], mmap_mode='r')
 
     def __len__(self):
         return len(self.hboxes)
 
     def __getitem__(self, item):
-        spa_map = torch.from_numpy(gen_spatial_map(self.hboxes[item],
-                                                   self.oboxes[item],
-                                                   self.obj_classes[item], 80))
-        obj_class_ind = self.obj_classes[item]
-        obj_class_vec = torch.zeros((self.num_obj_class))
-        obj_class_vec[obj_class_ind] = 1
-        pose_feat = torch.from_numpy(gen_pose_feat(self.skeletons[item], self.oboxes[item]))
-        return spa_map, \
-               self.obj2vec[self.obj_classes[item].item()], \
-               self.hoi_classes[item], \
-               self.bin_classes[item], \
-               obj_class_vec, \
-               pose_feat
+        return tuple(data[0] for data in collate_hico_batch(self.__getitems__([item])))
+
+    def __getitems__(self, items):
+        # fetch a whole batch with array indexing, see HICOBatchSampler and collate_hico_batch
+        inds = np.asarray(items, dtype=np.int64)
+        if self.spa_map_in_model:
+            # (B,8) human and object boxes, rasterized by SpaLan
+            spa_maps = np.concatenate((self.hboxes[inds], self.oboxes[inds]), axis=1)
+        elif self.spa_maps is not None:
+            spa_maps = self.spa_maps[inds]
+        else:
+            spa_maps = gen_spatial_maps_batch(self.hboxes[inds], self.oboxes[inds])
+        if self.spa_map_in_model:
+            pass
+        elif self.pack_spa_maps and spa_maps.dtype != np.uint8:
+            spa_maps = pack_spatial_maps(spa_maps)
+        elif not self.pack_spa_maps and spa_maps.dtype == np.uint8:
+            spa_maps = np.unpackbits(spa_maps, axis=-1).astype('float32')
+        spa_maps = torch.from_numpy(np.ascontiguousarray(spa_maps))
+
+        obj_classes = torch.from_numpy(self.obj_classes[inds]).long()
+        obj_class_vecs = torch.zeros((len(inds), self.num_obj_class))
+        obj_class_vecs[torch.arange(len(inds)).long(), obj_classes] = 1
+        pose_feats = torch.from_numpy(gen_pose_feats_batch(self.skeletons[inds],
+                                                           self.oboxes[inds],
+                                                           self.skeleton_valid[inds]))
+        # labels stay compact here, collate_hico_batch expands them to multi-hot rows
+        hoi_rows, hoi_inds = gather_csr(self.hoi_class_inds, self.hoi_class_offsets, inds)
+        hoi_classes = (torch.from_numpy(hoi_rows).long(), torch.from_numpy(hoi_inds.astype(np.int64)))
+        return spa_maps, \
+               self.obj2vec[obj_classes], \
+               hoi_classes, \
+               torch.from_numpy(self.bin_classes[inds]).long(), \
+               obj_class_vecs, \
+               pose_feats
+
+
+class HICOBatchSampler(Sampler):
+    # yields whole index arrays, sorted inside each batch so map store reads stay local
+    # bin_classes + neg_ratio: every epoch keeps all positives and draws neg_ratio negatives per
+    # positive of each image from the negatives of that image (cycled if there are too few), like
+    # lib's sample_hoi_negatives; without image_ids they are drawn from the whole negative pool.
+    # The pool is shuffled within each image once, an epoch only picks a random start per image,
+    # so a draw costs O(images + drawn pairs) instead of a shuffle of the whole pool.
+    # seed fixes the draw, e.g. for validation
+    def __init__(self, num_data, batch_size, shuffle=True, bin_classes=None, neg_ratio=None, seed=None,
+                 image_ids=None):
+        self.num_data = num_data
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.neg_ratio = neg_ratio
+        self.seed = seed
+        if neg_ratio is not None:
+            rand = np.random if seed is None else np.random.RandomState(seed)
+            bin_classes = np.asarray(bin_classes)
+            self.pos_inds = np.nonzero(bin_classes == 0)[0]
+            neg_inds = np.nonzero(bin_classes == 1)[0]
+            if image_ids is None:
+                print('[WARNING] no image ids, drawing the negatives from the whole pool')
+                image_ids = np.zeros(len(bin_classes), dtype=np.int64)
+            _, image_inds = np.unique(np.asarray(image_ids), return_inverse=True)
+            num_image = image_inds.max() + 1 if len(image_inds) > 0 else 0
+            neg_image_inds = image_inds[neg_inds]
+            num_pos = np.bincount(image_inds[self.pos_inds], minlength=num_image)
+            num_neg_pool = np.bincount(neg_image_inds, minlength=num_image)
+            num_neg = np.where(num_neg_pool > 0, np.round(num_pos * neg_ratio), 0).astype(np.int64)
+            # negatives grouped by image, in image order and shuffled within their image
+            self.neg_pool = neg_inds[np.lexsort((rand.random_sample(len(neg_inds)), neg_image_inds))]
+            # image i takes num_neg[i] of its group, from a random start and cycling through the group
+            self.neg_image_pools = np.maximum(num_neg_pool, 1)
+            self.draw_images = np.repeat(np.arange(num_image), num_neg)
+            self.draw_ranks = np.arange(num_neg.sum()) - np.repeat(np.cumsum(num_neg) - num_neg, num_neg)
+            self.draw_starts = (np.cumsum(num_neg_pool) - num_neg_pool)[self.draw_images]
+            self.num_data = len(self.pos_inds) + len(self.draw_images)
+
+    def __iter__(self):
+        rand = np.random if self.seed is None else np.random.RandomState(self.seed)
+        if self.neg_ratio is not None:
+            offsets = (rand.random_sample(len(self.neg_image_pools)) * self.neg_image_pools).astype(np.int64)
+            pools = self.neg_image_pools[self.draw_images]
+            draws = self.draw_starts + (offsets[self.draw_images] + self.draw_ranks) % pools
+            inds = np.concatenate((self.pos_inds, self.neg_pool[draws]))
+        else:
+            inds = np.arange(self.num_data)
+        if self.shuffle:
+            inds = inds[rand.permutation(self.num_data)]
+        for stt in range(0, self.num_data, self.batch_size):
+            yield np.sort(inds[stt:stt + self.batch_size]).tolist()
+
+    def __len__(self):
+        return (self.num_data + self.batch_size - 1) // self.batch_size
+
+
+def collate_hico_batch(batch, num_hoi_class=600):
+    # HICODatasetSpa.__getitems__ already returns a collated tuple of tensors with compact labels;
+    # torch versions without __getitems__ support hand over a list of samples instead
+    if isinstance(batch, tuple):
+        spa_maps, obj_vecs, (hoi_rows, hoi_inds), bin_classes, obj_class_vecs, pose_feats = batch
+        hoi_classes = torch.zeros((spa_maps.shape[0], num_hoi_class))
+        hoi_classes[hoi_rows, hoi_inds] = 1
+        return spa_maps, obj_vecs, hoi_classes, bin_classes, obj_class_vecs, pose_feats
+    return default_collate(batch)
+
+
+class HICOTestPairDataset(Dataset):
+    # candidate human-object pairs of many test images, built batch by batch in DataLoader workers
+    # skeletons / skeleton_valid are per human, pair_hum_inds points each pair to its human
+    def __init__(self, hboxes, oboxes, obj_inds, pair_hum_inds, skeletons, skeleton_valid,
+                 num_obj_class=80, pack_spa_maps=False, spa_map_in_model=False):
+        self.hboxes = hboxes
+        self.oboxes = oboxes
+        self.obj_inds = obj_inds
+        self.pair_hum_inds = pair_hum_inds
+        self.skeletons = skeletons
+        self.skeleton_valid = skeleton_valid
+        self.num_obj_class = num_obj_class
+        self.pack_spa_maps = pack_spa_maps
+        self.spa_map_in_model = spa_map_in_model
+
+    def __len__(self):
+        return len(self.hboxes)
+
+    def __getitem__(self, item):
+        return tuple(data[0] for data in self.__getitems__([item]))
+
+    def __getitems__(self, items):
+        inds = np.asarray(items, dtype=np.int64)
+        hboxes = self.hboxes[inds]
+        oboxes = self.oboxes[inds]
+        if self.spa_map_in_model:
+            # (B,8) human and object boxes, rasterized by SpaLan
+            spa_maps = np.concatenate((hboxes, oboxes), axis=1)
+        else:
+            spa_maps = gen_spatial_maps_batch(hboxes, oboxes)
+            if self.pack_spa_maps:
+                spa_maps = pack_spatial_maps(spa_maps)
+        spa_maps = torch.from_numpy(np.ascontiguousarray(spa_maps))
+
+        obj_inds = torch.from_numpy(self.obj_inds[inds]).long()
+        obj_vecs = torch.zeros((len(inds), self.num_obj_class))
+        obj_vecs[torch.arange(len(inds)).long(), obj_inds] = 1
+        hum_inds = self.pair_hum_inds[inds]
+        pose_feats = torch.from_numpy(gen_pose_feats_batch(self.skeletons[hum_inds], oboxes,
+                                                           self.skeleton_valid[hum_inds]))
+        return spa_maps, obj_vecs, obj_inds, pose_feats, torch.from_numpy(inds)
+
+
+def collate_hico_test_pairs(batch):
+    # see collate_hico_batch
+    if isinstance(batch, tuple):
+        return batch
+    return default_collate(batch)
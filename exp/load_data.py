@@ -1,12 +1,18 @@
 import os
-import random
+import glob
+import json
+import hashlib
 import pickle
+import mmap
+import multiprocessing
 from math import log, e
 
-import gensim
 import scipy.io as sio
 import numpy as np
 
+from dataset import gen_spatial_maps_batch, pack_spatial_maps, skeletons_to_array, class_ids_to_csr, \
+    multi_hot_to_csr
+
 
 class HOIClass:
     def __init__(self, object_name, verb_name, hoi_id):
@@ -47,19 +53,133 @@ def object_class_mapping(hoi_classes, hoi_obj_classes):
 
 
 
+def load_cache_manifest(save_dir):
+    # data_cache/cache_manifest.json: input file digests and the fingerprint each cached artifact was built with
+    manifest_path = os.path.join(save_dir, 'cache_manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)
+    return {'files': {}, 'artifacts': {}}
+
+
+def save_cache_manifest(save_dir, manifest):
+    manifest_path = os.path.join(save_dir, 'cache_manifest.json')
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.rename(manifest_path + '.tmp', manifest_path)
+
+
+# inputs larger than this (e.g. the multi-GB word2vec binary) are fingerprinted by
+# path, size and mtime instead of hashing their content
+HASH_MAX_SIZE = 1 << 28
+
+
+def file_digest(path, manifest):
+    # sha1 of the file content, only recomputed when size or mtime changed since the last run
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    if stat.st_size > HASH_MAX_SIZE:
+        return 'stat:%s:%d:%r' % (path, stat.st_size, stat.st_mtime)
+    record = manifest['files'].get(path)
+    if record is None or record['size'] != stat.st_size or record['mtime'] != stat.st_mtime:
+        print('Hashing %s ...' % path)
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 24), b''):
+                sha1.update(chunk)
+        record = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': sha1.hexdigest()}
+        manifest['files'][path] = record
+    return record['sha1']
+
+
+def cache_fingerprint(save_dir, input_paths, build_params):
+    # fingerprint of the inputs and build parameters of an artifact,
+    # None when an input is not available to check against
+    if not all(os.path.exists(path) for path in input_paths):
+        return None
+    manifest = load_cache_manifest(save_dir)
+    digests = [file_digest(path, manifest) for path in input_paths]
+    save_cache_manifest(save_dir, manifest)
+    key = json.dumps({'inputs': digests, 'params': build_params}, sort_keys=True)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def cache_is_fresh(save_dir, cache_path, fingerprint):
+    if not os.path.exists(cache_path):
+        return False
+    if fingerprint is None:
+        print('[WARNING] inputs of %s not found, using it unchecked' % cache_path)
+        return True
+    manifest = load_cache_manifest(save_dir)
+    if manifest['artifacts'].get(os.path.basename(cache_path)) == fingerprint:
+        return True
+    print('%s is stale, rebuilding ...' % cache_path)
+    return False
+
+
+def mark_cache_fresh(save_dir, cache_path, fingerprint):
+    manifest = load_cache_manifest(save_dir)
+    manifest['artifacts'][os.path.basename(cache_path)] = fingerprint
+    save_cache_manifest(save_dir, manifest)
+
+
+class Word2VecBinary:
+    # lookups into a word2vec .bin file (e.g. GoogleNews-vectors-negative300.bin) without loading it:
+    # the file is mmap-ed and scanned only as far as the requested words, the offsets of the words
+    # passed on the way are kept so later lookups resume the scan instead of restarting it
+    def __init__(self, w2v_path):
+        self._file = open(w2v_path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        header_end = self._mm.find(b'\n')
+        self.vocab_size, self.vector_size = map(int, self._mm[:header_end].split())
+        self._offsets = {}
+        self._num_scanned = 0
+        self._pos = header_end + 1
+
+    def _scan(self, words):
+        # words: set of byte strings still to be found
+        while words and self._num_scanned < self.vocab_size:
+            word_end = self._mm.find(b' ', self._pos)
+            if word_end < 0:
+                break
+            word = self._mm[self._pos:word_end].strip()
+            if word not in self._offsets:
+                self._offsets[word] = word_end + 1
+            words.discard(word)
+            self._pos = word_end + 1 + self.vector_size * 4
+            self._num_scanned += 1
+
+    def lookup(self, words):
+        # list of words -> list of float32 vectors, None for out of vocabulary words
+        words = [word.encode('utf-8') for word in words]
+        self._scan(set(word for word in words if word not in self._offsets))
+        vecs = []
+        for word in words:
+            if word in self._offsets:
+                vec = np.frombuffer(self._mm, dtype='<f4', count=self.vector_size, offset=self._offsets[word])
+                vecs.append(vec.copy())
+            else:
+                vecs.append(None)
+        return vecs
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+
 def load_object_word2vec(object_classes, w2v_path, save_dir):
     print('Loading obj2vec ...')
 
     obj2vec_path = os.path.join(save_dir, 'hico_obj2vec.pkl')
-    if os.path.exists(obj2vec_path):
+    fingerprint = cache_fingerprint(save_dir, [w2v_path], {'object_classes': list(object_classes)})
+    if cache_is_fresh(save_dir, obj2vec_path, fingerprint):
         with open(obj2vec_path) as f:
             obj2vec = pickle.load(f)
         return obj2vec
 
-    # load pretrained word2vec
-    model = gensim.models.KeyedVectors.load_word2vec_format(w2v_path, binary=True)
-    obj2vec = np.zeros((len(object_classes), 300))
-    for i, obj_class in enumerate(object_classes):
+    # read only the object vectors from the pretrained word2vec
+    obj_classes_clean = []
+    for obj_class in object_classes:
         obj_class_clean = obj_class
 
         if obj_class == 'dining_table':
@@ -92,14 +212,23 @@ def load_object_word2vec(object_classes, w2v_path, save_dir):
             obj_class_clean = 'light'
         elif obj_class == 'wine_glass':
             obj_class_clean = 'glass'
+        obj_classes_clean.append(obj_class_clean)
+
+    model = Word2VecBinary(w2v_path)
+    vecs = model.lookup(obj_classes_clean)
+    model.close()
 
-        vec = model[obj_class_clean]
+    obj2vec = np.zeros((len(object_classes), 300))
+    for i, obj_class in enumerate(object_classes):
+        vec = vecs[i]
         if vec is None or len(vec) == 0 or np.sum(vec) == 0:
             print('[WARNING] %s' % obj_class)
+            continue
         obj2vec[i] = vec
 
     with open(obj2vec_path, 'wb') as f:
         pickle.dump(obj2vec, f)
+    mark_cache_fresh(save_dir, obj2vec_path, fingerprint)
     return obj2vec
 
 
@@ -154,11 +283,21 @@ def load_hoi_classes(hoi_class_path):
     return hoi_cls_list, obj_cls_list, vrb_cls_list, hoi2int
 
 
+def object_hoi_ranges(hoi_classes, obj_classes, hoi2int):
+    # [first, last] hoi class of every object class, in obj_classes order
+    obj2ind = dict(zip(obj_classes, xrange(len(obj_classes))))
+    obj_hoi_ranges = [None] * len(obj_classes)
+    for hoi_ind, hoi_class in enumerate(hoi_classes):
+        obj_hoi_ranges[obj2ind[hoi_class.object_name()]] = hoi2int[hoi_ind]
+    return obj_hoi_ranges
+
+
 def load_image_info(anno_path, save_dir, image_set='train'):
     print('Loading image set info ...')
 
     save_path = os.path.join(save_dir, 'hico_image_info_%s.pkl' % image_set)
-    if os.path.exists(save_path):
+    fingerprint = cache_fingerprint(save_dir, [anno_path], {'image_set': image_set})
+    if cache_is_fresh(save_dir, save_path, fingerprint):
         with open(save_path) as f:
             all_image_info = pickle.load(f)
         return all_image_info
@@ -174,6 +313,7 @@ def load_image_info(anno_path, save_dir, image_set='train'):
 
     with open(save_path, 'wb') as f:
         pickle.dump(all_image_info, f)
+    mark_cache_fresh(save_dir, save_path, fingerprint)
     return all_image_info
 
 
@@ -204,71 +344,86 @@ def extract_spatial_feature(box1, box2, image_size):
     return spatial_feat
 
 
-def prepare_hico(hico_root, save_dir):
-    hoi_db_path = os.path.join(save_dir, 'hico_trainval_anno.pkl')
-    if not os.path.exists(save_dir):
-        os.mkdir(save_dir)
-
-    if os.path.exists(hoi_db_path):
-        print('Loading annotations ...')
-        with open(hoi_db_path) as f:
-            hoi_db = pickle.load(f)
-        return hoi_db
-
-    image_info_path = os.path.join(hico_root, 'anno_bbox_full.mat')
-    image_info = load_image_info(image_info_path, save_dir)
-
-    hoi_class_path = os.path.join(hico_root, 'hoi_categories.pkl')
-    hoi_cates, obj_cates, vrb_cates, _ = load_hoi_classes(hoi_class_path)
-    obj2ind = dict(zip(obj_cates, xrange(len(obj_cates))))
-
-    hoi_class_num = len(hoi_cates)
-    obj2vec = load_object_word2vec(obj_cates, 'GoogleNews-vectors-negative300.bin', save_dir)
-
-    print('Loading annotations ...')
-    anno_gt_path = os.path.join(hico_root, 'train_GT_HICO_with_pose.pkl')
-    anno_ng_path = os.path.join(hico_root, 'train_NG_HICO_with_pose.pkl')
-    anno_gt = pickle.load(open(anno_gt_path))
-    anno_ng = pickle.load(open(anno_ng_path))
+def extract_spatial_features_batch(hboxes, oboxes, image_sizes):
+    # array version of extract_spatial_feature: (N,4) human boxes, (N,4) object boxes,
+    # (N,2) image sizes (w, h) -> (N,14) float32
+    hboxes = np.asarray(hboxes, dtype=np.float64).reshape(-1, 4)
+    oboxes = np.asarray(oboxes, dtype=np.float64).reshape(-1, 4)
+    image_sizes = np.asarray(image_sizes, dtype=np.float64).reshape(-1, 2)
+    img_wh = np.tile(image_sizes, 2)
+    img_area = image_sizes[:, 0] * image_sizes[:, 1]
+
+    sbj_wh = hboxes[:, 2:] - hboxes[:, :2] + 1
+    obj_wh = oboxes[:, 2:] - oboxes[:, :2] + 1
+    spatial_feats = np.concatenate((
+        hboxes / img_wh,
+        (sbj_wh[:, 0] * sbj_wh[:, 1] / img_area)[:, np.newaxis],
+        oboxes / img_wh,
+        (obj_wh[:, 0] * obj_wh[:, 1] / img_area)[:, np.newaxis],
+        (hboxes[:, :2] - oboxes[:, :2] + 1) / obj_wh,
+        np.log(sbj_wh / obj_wh)), axis=1)
+    return spatial_feats.astype(np.float32)
+
+
+def spa_map_fingerprint(save_dir, hoi_db_dir, image_set, db_fingerprint, packed):
+    # the map store of a split is built from its box columns in the hoi_db dir
+    box_paths = [os.path.join(hoi_db_dir, '%s_%s.npy' % (image_set, field)) for field in ('hboxes', 'oboxes')]
+    return cache_fingerprint(save_dir, box_paths, {'hoi_db': db_fingerprint, 'packed': packed})
+
+
+def load_spatial_maps(hboxes, oboxes, save_dir, image_set='train', packed=False, rebuild=False, chunk_size=4096,
+                      fingerprint=None):
+    # rasterize all spatial maps once into an .npy file, read back with np.load(mmap_mode='r')
+    # packed: store 1 bit per pixel (np.packbits layout, (N,2,64,8) uint8) instead of float32
+    # fingerprint: spa_map_fingerprint of the boxes, the store is rebuilt when it changed
+    print('Loading spatial maps ...')
+
+    save_path = os.path.join(save_dir, 'hico_spa_maps_%s%s.npy' % (image_set, '_packed' if packed else ''))
+    num_item = len(hboxes)
+    if rebuild:
+        for stale_path in glob.glob(os.path.join(save_dir, 'hico_spa_maps_%s*.npy' % image_set)):
+            os.remove(stale_path)
+    elif cache_is_fresh(save_dir, save_path, fingerprint):
+        return save_path
+
+    if packed:
+        dtype, shape = 'uint8', (num_item, 2, 64, 8)
+    else:
+        dtype, shape = 'float32', (num_item, 2, 64, 64)
+    tmp_path = save_path + '.tmp'
+    spa_maps = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=shape)
+    for stt in range(0, num_item, chunk_size):
+        end = min(stt + chunk_size, num_item)
+        spa_maps_chunk = gen_spatial_maps_batch(hboxes[stt:end], oboxes[stt:end])
+        if packed:
+            spa_maps_chunk = pack_spatial_maps(spa_maps_chunk)
+        spa_maps[stt:end] = spa_maps_chunk
+    spa_maps.flush()
+    del spa_maps
+    os.rename(tmp_path, save_path)
+    mark_cache_fresh(save_dir, save_path, fingerprint)
+    return save_path
+
+
+def build_hoi_shard(shard):
+    # process pool worker of prepare_hico: positives and the whole negative pool of a run of images,
+    # negatives are drawn per epoch by dataset.HICOBatchSampler
+    image_hois, hoi2obj = shard
 
     hboxes = []
     oboxes = []
-    spa_feats = []
+    image_sizes = []
+    image_ids = []
     hoi_classes = []
     bin_classes = []
     obj_classes = []
     skeletons = []
 
-    print('Processing annotations ...')
-    anno_gt_db = {}
-    for hoi_ins_gt in anno_gt:
-        image_id = hoi_ins_gt[0]
-        if image_id in anno_gt_db:
-            anno_gt_db[image_id].append(hoi_ins_gt)
-        else:
-            anno_gt_db[image_id] = [hoi_ins_gt]
-
-    for image_id, img_pos_hois in anno_gt_db.items():
+    for image_id, img_pos_hois, img_neg_hois, image_size in image_hois:
 
-        image_size = image_info[image_id]
         if image_size[0] == 0 or image_size[1] == 0:
             print(image_id)
 
-        if image_id in anno_ng and len(anno_ng[image_id]) > 0:
-            img_neg_hois0 = anno_ng[image_id]
-            if len(img_neg_hois0) > len(img_pos_hois):
-                inds = random.sample(range(len(img_neg_hois0)), len(img_pos_hois))
-            else:
-                inds = []
-                for i in range(int(len(img_pos_hois) / len(img_neg_hois0))):
-                    inds += range(len(img_neg_hois0))
-                for i in range(len(img_pos_hois) - len(inds)):
-                    inds.append(i)
-            img_neg_hois = [img_neg_hois0[ind] for ind in inds]
-            assert len(img_neg_hois) == len(img_pos_hois)
-        else:
-            img_neg_hois = []
-
         for pn, hois in enumerate([img_pos_hois, img_neg_hois]):
             for raw_hoi in hois:
                 hbox = raw_hoi[2]
@@ -278,60 +433,231 @@ def prepare_hico(hico_root, save_dir):
                 if isinstance(hoi_class_ids, int):
                     hoi_class_ids = [hoi_class_ids]
 
-                obj_class = obj2ind[hoi_cates[hoi_class_ids[0]].object_name()]
-                hoi_class = [0] * hoi_class_num
+                obj_class = hoi2obj[hoi_class_ids[0]]
                 if pn == 0:
                     skeleton = raw_hoi[5]
                 else:
                     skeleton = raw_hoi[7]
 
-                for id in hoi_class_ids:
-                    hoi_class[id] = 1
-
-                hbox_tmp = {
-                    'xmin': float(hbox[0]),
-                    'ymin': float(hbox[1]),
-                    'xmax': float(hbox[2]),
-                    'ymax': float(hbox[3]),
-                }
-                obox_tmp = {
-                    'xmin': float(obox[0]),
-                    'ymin': float(obox[1]),
-                    'xmax': float(obox[2]),
-                    'ymax': float(obox[3]),
-                }
-                spa_feat = extract_spatial_feature(hbox_tmp, obox_tmp, image_size)
-                spa_feats.append(spa_feat)
                 hboxes.append(hbox)
                 oboxes.append(obox)
+                image_sizes.append(image_size)
+                image_ids.append(image_id)
                 obj_classes.append(obj_class)
-                hoi_classes.append(hoi_class)
+                hoi_classes.append(hoi_class_ids)
                 bin_classes.append(bin_class)
                 skeletons.append(skeleton)
 
-    num_item = len(hboxes)
-    num_train = int(num_item * 0.7)
+    skeletons, skeleton_valid = skeletons_to_array(skeletons)
+    return {
+        'hboxes': np.array(hboxes),
+        'oboxes': np.array(oboxes),
+        'spa_feats': extract_spatial_features_batch(hboxes, oboxes, image_sizes),
+        'image_ids': np.array(image_ids, dtype=np.int64),
+        'obj_classes': np.array(obj_classes),
+        'hoi_classes': hoi_classes,
+        'bin_classes': np.array(bin_classes),
+        'skeletons': skeletons,
+        'skeleton_valid': skeleton_valid,
+    }
+
+
+def save_hoi_db(hoi_db, db_dir):
+    # columnar layout: <split>_<field>.npy for every array field + manifest.json,
+    # the manifest is written last so an interrupted save is never picked up
+    if not os.path.exists(db_dir):
+        os.mkdir(db_dir)
+
+    manifest = {}
+    for image_set, db in hoi_db.items():
+        manifest[image_set] = {}
+        for field, data in db.items():
+            if field == 'spa_map_path':
+                continue
+            data = np.asarray(data)
+            assert data.dtype != np.object_, 'field %s of %s is not columnar' % (field, image_set)
+            file_name = '%s_%s.npy' % (image_set, field)
+            tmp_path = os.path.join(db_dir, file_name + '.tmp')
+            with open(tmp_path, 'wb') as f:
+                np.save(f, data)
+            os.rename(tmp_path, os.path.join(db_dir, file_name))
+            manifest[image_set][field] = {
+                'file': file_name,
+                'dtype': data.dtype.str,
+                'shape': list(data.shape),
+            }
+
+    manifest_path = os.path.join(db_dir, 'manifest.json')
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.rename(manifest_path + '.tmp', manifest_path)
+
+
+def load_hoi_db(db_dir):
+    # every field is opened with mmap_mode='r': nothing is read until it is indexed
+    # and DataLoader workers share the pages
+    with open(os.path.join(db_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+
+    hoi_db = {}
+    for image_set, fields in manifest.items():
+        hoi_db[image_set] = {}
+        for field, info in fields.items():
+            data = np.load(os.path.join(db_dir, info['file']), mmap_mode='r')
+            assert list(data.shape) == info['shape'], 'stale column %s' % info['file']
+            hoi_db[image_set][field] = data
+    return hoi_db
+
+
+def train_split_row(image_ids, bin_classes, train_ratio=0.7):
+    # first val row of the full-pool db, where the train_ratio split of the old db (every positive of an image
+    # + as many sampled negatives, none without negatives) fell: the same images and positives on each side,
+    # the negatives of the image at the boundary split in the proportion its sampled ones were
+    starts = np.flatnonzero(np.r_[True, image_ids[1:] != image_ids[:-1]])
+    num_pos = np.add.reduceat((bin_classes == 0).astype(np.int64), starts)
+    num_neg = np.add.reduceat((bin_classes == 1).astype(np.int64), starts)
+    old_counts = num_pos + np.where(num_neg > 0, num_pos, 0)
+    old_ends = np.cumsum(old_counts)
+    num_old_train = int(old_ends[-1] * train_ratio)
+    k = np.searchsorted(old_ends, num_old_train, 'right')
+    if k == len(starts):
+        return len(image_ids)
+    rank = num_old_train - (old_ends[k] - old_counts[k])
+    if rank <= num_pos[k]:
+        return starts[k] + rank
+    # a negative stays on each side when there are enough of them
+    num_neg_train = int(round((rank - num_pos[k]) * num_neg[k] / float(num_pos[k])))
+    num_neg_train = min(max(num_neg_train, 1), max(num_neg[k] - 1, 1))
+    return starts[k] + num_pos[k] + num_neg_train
+
+
+def convert_hoi_db(hoi_db_path, db_dir):
+    # hico_trainval_anno.pkl -> columnar layout, older pickles
+    # (dense multi-hot labels, skeleton lists) are brought up to date on the way
+    print('Converting %s ...' % hoi_db_path)
+    with open(hoi_db_path, 'rb') as f:
+        hoi_db = pickle.load(f)
+
+    for db in hoi_db.values():
+        db.pop('spa_map_path', None)
+        if 'hoi_classes' in db:
+            db['hoi_class_inds'], db['hoi_class_offsets'] = multi_hot_to_csr(np.array(db.pop('hoi_classes')))
+        if isinstance(db['skeletons'], list):
+            db['skeletons'], db['skeleton_valid'] = skeletons_to_array(db['skeletons'])
+    save_hoi_db(hoi_db, db_dir)
+
+
+def prepare_hico(hico_root, save_dir, pack_spa_maps=False, build_spa_maps=True,
+                 num_workers=None, num_shards=64):
+    hoi_db_dir = os.path.join(save_dir, 'hico_trainval_anno')
+    hoi_db_path = os.path.join(save_dir, 'hico_trainval_anno.pkl')
+    if not os.path.exists(save_dir):
+        os.mkdir(save_dir)
+
+    image_info_path = os.path.join(hico_root, 'anno_bbox_full.mat')
+    hoi_class_path = os.path.join(hico_root, 'hoi_categories.pkl')
+    w2v_path = 'GoogleNews-vectors-negative300.bin'
+    anno_gt_path = os.path.join(hico_root, 'train_GT_HICO_with_pose.pkl')
+    anno_ng_path = os.path.join(hico_root, 'train_NG_HICO_with_pose.pkl')
+    fingerprint = cache_fingerprint(save_dir,
+                                    [image_info_path, hoi_class_path, w2v_path, anno_gt_path, anno_ng_path],
+                                    {'num_shards': num_shards, 'negatives': 'all', 'image_ids': True,
+                                     'split': 'sampled'})
+
+    manifest_path = os.path.join(hoi_db_dir, 'manifest.json')
+    if fingerprint is None and not os.path.exists(manifest_path) and os.path.exists(hoi_db_path):
+        # nothing to rebuild from, fall back to the pickled db of older versions
+        convert_hoi_db(hoi_db_path, hoi_db_dir)
+
+    if os.path.exists(manifest_path) and cache_is_fresh(save_dir, hoi_db_dir, fingerprint):
+        print('Loading annotations ...')
+        hoi_db = load_hoi_db(hoi_db_dir)
+        for image_set in ['train', 'val']:
+            if not build_spa_maps:
+                break
+            db = hoi_db[image_set]
+            map_fingerprint = spa_map_fingerprint(save_dir, hoi_db_dir, image_set, fingerprint, pack_spa_maps)
+            db['spa_map_path'] = load_spatial_maps(db['hboxes'], db['oboxes'], save_dir, image_set,
+                                                   packed=pack_spa_maps, fingerprint=map_fingerprint)
+        return hoi_db
+
+    image_info = load_image_info(image_info_path, save_dir)
+
+    hoi_cates, obj_cates, vrb_cates, _ = load_hoi_classes(hoi_class_path)
+    obj2ind = dict(zip(obj_cates, xrange(len(obj_cates))))
+
+    obj2vec = load_object_word2vec(obj_cates, w2v_path, save_dir)
+
+    print('Loading annotations ...')
+    anno_gt = pickle.load(open(anno_gt_path))
+    anno_ng = pickle.load(open(anno_ng_path))
+
+    print('Processing annotations ...')
+    anno_gt_db = {}
+    for hoi_ins_gt in anno_gt:
+        image_id = hoi_ins_gt[0]
+        if image_id in anno_gt_db:
+            anno_gt_db[image_id].append(hoi_ins_gt)
+        else:
+            anno_gt_db[image_id] = [hoi_ins_gt]
+
+    # shards are contiguous runs of images, merged back in order
+    hoi2obj = [obj2ind[hoi_cate.object_name()] for hoi_cate in hoi_cates]
+    image_hois = [(image_id, img_pos_hois, anno_ng.get(image_id, []), image_info[image_id])
+                  for image_id, img_pos_hois in anno_gt_db.items()]
+    shard_size = (len(image_hois) + num_shards - 1) // num_shards
+    shards = [(image_hois[stt:stt + shard_size], hoi2obj) for stt in range(0, len(image_hois), shard_size)]
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    if num_workers > 1:
+        pool = multiprocessing.Pool(min(num_workers, len(shards)))
+        shard_dbs = pool.map(build_hoi_shard, shards)
+        pool.close()
+        pool.join()
+    else:
+        shard_dbs = [build_hoi_shard(shard) for shard in shards]
+
+    hboxes = np.concatenate([shard_db['hboxes'] for shard_db in shard_dbs])
+    oboxes = np.concatenate([shard_db['oboxes'] for shard_db in shard_dbs])
+    spa_feats = np.concatenate([shard_db['spa_feats'] for shard_db in shard_dbs])
+    image_ids = np.concatenate([shard_db['image_ids'] for shard_db in shard_dbs])
+    obj_classes = np.concatenate([shard_db['obj_classes'] for shard_db in shard_dbs])
+    bin_classes = np.concatenate([shard_db['bin_classes'] for shard_db in shard_dbs])
+    skeletons = np.concatenate([shard_db['skeletons'] for shard_db in shard_dbs])
+    skeleton_valid = np.concatenate([shard_db['skeleton_valid'] for shard_db in shard_dbs])
+    hoi_classes = [hoi_class_ids for shard_db in shard_dbs for hoi_class_ids in shard_db['hoi_classes']]
+
+    # split where the db with one sampled negative per positive was split, the val images stay the same
+    num_train = train_split_row(image_ids, bin_classes)
+    train_hoi_inds, train_hoi_offsets = class_ids_to_csr(hoi_classes[:num_train])
+    val_hoi_inds, val_hoi_offsets = class_ids_to_csr(hoi_classes[num_train:])
 
     train_db = {
         'obj2vec': obj2vec,
-        'hboxes': np.array(hboxes[:num_train]),
-        'oboxes': np.array(oboxes[:num_train]),
-        'spa_feats': np.array(spa_feats[:num_train]),
-        'obj_classes': np.array(obj_classes[:num_train]),
-        'hoi_classes': np.array(hoi_classes[:num_train]),
-        'bin_classes': np.array(bin_classes[:num_train]),
-        'skeletons': skeletons[:num_train]
+        'hboxes': hboxes[:num_train],
+        'oboxes': oboxes[:num_train],
+        'spa_feats': spa_feats[:num_train],
+        'image_ids': image_ids[:num_train],
+        'obj_classes': obj_classes[:num_train],
+        'hoi_class_inds': train_hoi_inds,
+        'hoi_class_offsets': train_hoi_offsets,
+        'bin_classes': bin_classes[:num_train],
+        'skeletons': skeletons[:num_train],
+        'skeleton_valid': skeleton_valid[:num_train]
     }
 
     val_db = {
         'obj2vec': obj2vec,
-        'hboxes': np.array(hboxes[num_train:]),
-        'oboxes': np.array(oboxes[num_train:]),
-        'spa_feats': np.array(spa_feats[num_train:]),
-        'obj_classes': np.array(obj_classes[num_train:]),
-        'hoi_classes': np.array(hoi_classes[num_train:]),
-        'bin_classes': np.array(bin_classes[num_train:]),
-        'skeletons': skeletons[num_train:]
+        'hboxes': hboxes[num_train:],
+        'oboxes': oboxes[num_train:],
+        'spa_feats': spa_feats[num_train:],
+        'image_ids': image_ids[num_train:],
+        'obj_classes': obj_classes[num_train:],
+        'hoi_class_inds': val_hoi_inds,
+        'hoi_class_offsets': val_hoi_offsets,
+        'bin_classes': bin_classes[num_train:],
+        'skeletons': skeletons[num_train:],
+        'skeleton_valid': skeleton_valid[num_train:]
     }
 
     hoi_db = {
@@ -339,6 +665,14 @@ def prepare_hico(hico_root, save_dir):
         'val': val_db,
     }
 
-    with open(hoi_db_path, 'wb') as f:
-        pickle.dump(hoi_db, f)
+    save_hoi_db(hoi_db, hoi_db_dir)
+    mark_cache_fresh(save_dir, hoi_db_dir, fingerprint)
+
+    for image_set in ['train', 'val']:
+        if not build_spa_maps:
+            break
+        db = hoi_db[image_set]
+        map_fingerprint = spa_map_fingerprint(save_dir, hoi_db_dir, image_set, fingerprint, pack_spa_maps)
+        db['spa_map_path'] = load_spatial_maps(db['hboxes'], db['oboxes'], save_dir, image_set,
+                                               packed=pack_spa_maps, rebuild=True, fingerprint=map_fingerprint)
     return hoi_db
\ No newline at end of file
@@ -1,10 +1,27 @@
 import math
 
+import numpy as np
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from torch.autograd import Variable
 
+# SpaMapRasterizer is the one of lib/model/utils, shared with lib's _fasterRCNN
+import _init_paths
+from spa_rasterizer import SpaMapRasterizer
+
+
+# bit values of every possible byte, in np.packbits order
+_BYTE_BITS = torch.from_numpy(np.unpackbits(np.arange(256, dtype=np.uint8)[:, np.newaxis], axis=1).astype('float32'))
+
+
+def unpack_spatial_maps(packed_maps):
+    # (N,2,64,8) uint8 -> (N,2,64,64) float, inverse of dataset.pack_spatial_maps
+    byte_bits = _BYTE_BITS.to(packed_maps.device)
+    spa_map = byte_bits.index_select(0, packed_maps.contiguous().view(-1).long())
+    return spa_map.view(packed_maps.shape[:-1] + (packed_maps.shape[-1] * 8,))
+
 
 class SpaConv(nn.Module):
     def __init__(self):
@@ -19,6 +36,8 @@ class SpaConv(nn.Module):
         self.pool2 = nn.MaxPool2d(kernel_size=2, stride=2)
 
     def forward(self, spa_map):
+        if spa_map.dtype == torch.uint8:
+            spa_map = unpack_spatial_maps(spa_map)
         conv1 = self.conv1(spa_map)
         pool1 = self.pool1(conv1)
         conv2 = self.conv2(pool1)
@@ -45,9 +64,23 @@ class SpaLan(nn.Module):
     def __str__(self):
         return 'Spa+Obj+Pose'
 
-    def __init__(self, spa_feat_dim, num_hoi_class, num_obj_class, num_key_point):
+    def __init__(self, spa_feat_dim, num_hoi_class, num_obj_class, num_key_point, obj_hoi_ranges=None):
         super(SpaLan, self).__init__()
 
+        # obj_hoi_ranges: (first, last) hoi class of every object class, see load_data.object_hoi_ranges.
+        # When given, the classifiers only score the hoi classes of each sample's object
+        # and hoi_prob is (N,K) in that range, padded with zeros up to the longest range
+        self.num_hoi_class = num_hoi_class
+        self.num_obj_class = num_obj_class
+        self.obj_hoi_ranges = obj_hoi_ranges
+        if obj_hoi_ranges is not None:
+            max_range_len = max(end - stt + 1 for stt, end in obj_hoi_ranges)
+            self.hoi_range_inds = torch.LongTensor([[min(stt + i, end) for i in range(max_range_len)]
+                                                    for stt, end in obj_hoi_ranges])
+            self.hoi_range_mask = torch.FloatTensor([[float(stt + i <= end) for i in range(max_range_len)]
+                                                     for stt, end in obj_hoi_ranges])
+
+        self.spa_rasterizer = SpaMapRasterizer()
         self.spa_conv = SpaConv()
 
         self.spa_hidden_layer = nn.Sequential(
@@ -93,22 +126,93 @@ class SpaLan(nn.Module):
 
         # self._initialize_weights()
 
-    def forward(self, spa_map, obj_vec, pose_feat, hoi_cates=None, bin_cates=None, pos_mask=None):
+        # eval-time lookup table of the object branch, see compile_obj_branch
+        self.obj_prob_table = None
+        self.obj_table_version = None
+
+    def hoi_ranges(self, obj_inds):
+        # (N,K) hoi class indices and validity mask of the object classes obj_inds
+        if self.hoi_range_inds.device != obj_inds.device:
+            self.hoi_range_inds = self.hoi_range_inds.to(obj_inds.device)
+            self.hoi_range_mask = self.hoi_range_mask.to(obj_inds.device)
+        return self.hoi_range_inds[obj_inds], self.hoi_range_mask[obj_inds]
+
+    def _obj_branch_version(self):
+        params = list(self.obj_hidden_layer.parameters()) + list(self.spa_classifier.parameters())
+        return [(param.data_ptr(), param._version) for param in params]
+
+    def compile_obj_branch(self):
+        # the object branch only ever sees one-hot class vectors, so in eval mode its
+        # (num_obj_class, num_hoi_class) sigmoid outputs can be computed once and looked up;
+        # the table is ignored as soon as its weights are updated, moved or reloaded
+        was_training = self.training
+        self.eval()
+        with torch.no_grad():
+            obj_vecs = torch.eye(self.num_obj_class, device=self.obj_hidden_layer[0].weight.device)
+            obj_hidden = self.obj_hidden_layer(obj_vecs)
+            self.obj_prob_table = F.sigmoid(self.spa_classifier(obj_hidden))
+        self.train(was_training)
+        self.obj_table_version = self._obj_branch_version()
+
+    def obj_table_valid(self):
+        return self.obj_prob_table is not None and self.obj_table_version == self._obj_branch_version()
+
+    @staticmethod
+    def range_scores(classifier, hidden, hoi_inds):
+        # classifier(hidden) at the (N,K) columns hoi_inds only: gather the weight rows, batched matmul
+        layers = list(classifier.children())
+        for layer in layers[:-1]:
+            hidden = layer(hidden)
+        weight = layers[-1].weight[hoi_inds]
+        bias = layers[-1].bias[hoi_inds]
+        return torch.bmm(weight, hidden.unsqueeze(2)).squeeze(2) + bias
+
+    def scatter_hoi_scores(self, hoi_prob, obj_inds):
+        # (N,K) range scores of the object classes obj_inds -> (N,num_hoi_class), zero outside the ranges
+        hoi_inds, hoi_mask = self.hoi_ranges(obj_inds)
+        dense_prob = torch.zeros((hoi_prob.shape[0], self.num_hoi_class), device=hoi_prob.device)
+        return dense_prob.scatter_add_(1, hoi_inds, hoi_prob * hoi_mask)
+
+    def forward(self, spa_map, obj_vec, pose_feat, hoi_cates=None, bin_cates=None, pos_mask=None, obj_inds=None):
+        # obj_inds: (N,) object classes of the one-hot obj_vec, lets eval use the compiled object branch
         num_ins = spa_map.shape[0]
 
+        hoi_inds = None
+        if self.obj_hoi_ranges is not None:
+            if obj_inds is None:
+                obj_inds = torch.max(obj_vec, 1)[1]
+            hoi_inds, hoi_mask = self.hoi_ranges(obj_inds)
+
+        if spa_map.dim() == 2:
+            # (N,8) human and object boxes instead of precomputed maps
+            spa_map = self.spa_rasterizer(spa_map[:, :4], spa_map[:, 4:])
         spa_vec = self.spa_conv(spa_map)
         spa_hidden = self.spa_hidden_layer(spa_vec)
-        spa_hoi_scores = self.spa_classifier(spa_hidden)
+        if hoi_inds is None:
+            spa_hoi_scores = self.spa_classifier(spa_hidden)
+        else:
+            spa_hoi_scores = self.range_scores(self.spa_classifier, spa_hidden, hoi_inds)
         spa_hoi_prob = F.sigmoid(spa_hoi_scores)
         # spa_bin_scores = self.spa_proposal(spa_hidden)
 
-        obj_hidden = self.obj_hidden_layer(obj_vec)
-        obj_hoi_scores = self.spa_classifier(obj_hidden)
-        obj_hoi_prob = F.sigmoid(obj_hoi_scores)
+        if not self.training and obj_inds is not None and self.obj_table_valid():
+            obj_hoi_prob = self.obj_prob_table[obj_inds]
+            if hoi_inds is not None:
+                obj_hoi_prob = obj_hoi_prob.gather(1, hoi_inds)
+        else:
+            obj_hidden = self.obj_hidden_layer(obj_vec)
+            if hoi_inds is None:
+                obj_hoi_scores = self.spa_classifier(obj_hidden)
+            else:
+                obj_hoi_scores = self.range_scores(self.spa_classifier, obj_hidden, hoi_inds)
+            obj_hoi_prob = F.sigmoid(obj_hoi_scores)
         # obj_bin_scores = self.obj_proposal(obj_hidden)
 
         pose_hidden = self.pose_hidden_layer(pose_feat)
-        pose_hoi_scores = self.pose_classifier(pose_hidden)
+        if hoi_inds is None:
+            pose_hoi_scores = self.pose_classifier(pose_hidden)
+        else:
+            pose_hoi_scores = self.range_scores(self.pose_classifier, pose_hidden, hoi_inds)
         pose_hoi_prob = F.sigmoid(pose_hoi_scores)
         # pose_bin_scores = self.pose_proposal(pose_hidden)
 
@@ -118,6 +222,9 @@ class SpaLan(nn.Module):
         # bin_prob = F.softmax(bin_scores, dim=1)
         bin_prob = torch.zeros(num_ins)
         hoi_prob = spa_hoi_prob * obj_hoi_prob * pose_hoi_prob
+        loss_weight = None
+        if hoi_inds is not None:
+            hoi_prob = hoi_prob * hoi_mask
 
         # bin_pred = torch.argmax(bin_prob, dim=1)
         hoi_pred = (hoi_prob > 0.5).float()
@@ -129,12 +236,16 @@ class SpaLan(nn.Module):
         loss_bin = torch.zeros(1)
 
         if hoi_cates is not None and bin_cates is not None:
+            if hoi_inds is not None:
+                # labels and loss restricted to the object's hoi range as well
+                hoi_cates = hoi_cates.gather(1, hoi_inds) * hoi_mask
+                loss_weight = hoi_mask[pos_mask]
             # bin_error = torch.abs(bin_pred - bin_cates).sum().float() / num_ins
             hoi_error = torch.abs(hoi_pred[pos_mask] - hoi_cates[pos_mask]).sum() * 1.0 / pos_mask.sum().item()
             # loss_bin = F.cross_entropy(bin_scores, bin_cates, size_average=False)
-            spa_loss_cls = F.binary_cross_entropy(spa_hoi_prob[pos_mask], hoi_cates[pos_mask], size_average=False)    # multi-label classification
-            obj_loss_cls = F.binary_cross_entropy(obj_hoi_prob[pos_mask], hoi_cates[pos_mask], size_average=False)
-            pos_loss_cls = F.binary_cross_entropy(pose_hoi_prob[pos_mask], hoi_cates[pos_mask], size_average=False)
+            spa_loss_cls = F.binary_cross_entropy(spa_hoi_prob[pos_mask], hoi_cates[pos_mask], weight=loss_weight, size_average=False)    # multi-label classification
+            obj_loss_cls = F.binary_cross_entropy(obj_hoi_prob[pos_mask], hoi_cates[pos_mask], weight=loss_weight, size_average=False)
+            pos_loss_cls = F.binary_cross_entropy(pose_hoi_prob[pos_mask], hoi_cates[pos_mask], weight=loss_weight, size_average=False)
             loss_cls = spa_loss_cls + obj_loss_cls + pos_loss_cls
             loss_bin = Variable(loss_bin)
         return bin_prob, hoi_prob, loss_bin, loss_cls, bin_error, hoi_error
@@ -9,82 +9,167 @@ import torch
 from torch.utils.data import DataLoader
 from torch.autograd import Variable
 
-from load_data import prepare_hico, load_hoi_classes
-from dataset import HICODatasetSpa, gen_spatial_map, gen_pose_feat
+from load_data import prepare_hico, load_hoi_classes, object_hoi_ranges
+from dataset import HICODatasetSpa, gen_spatial_maps_batch, pack_spatial_maps, \
+    skeletons_to_array, gen_pose_feats_batch, HICOBatchSampler, HICOTestPairDataset, collate_hico_test_pairs
 from model import SpaLan
+import _init_paths
+from hoi_pairs import detections_to_arrays, candidate_pairs
+from hoi_results import pack_hoi_results, save_hoi_results, hoi_results_exist, gather_range_scores
 from load_data import load_image_info, extract_spatial_feature, object_class_mapping
-from generate_HICO_detection import generate_HICO_detection
+from generate_HICO_detection import eval_HICO_results
 
 
-def test_image(model, im_obj_dets, image_size, det_obj2hoi_obj, obj2vec):
+def hoi_det_entry(hum_det, obj_det, hoi_prob, bin_prob):
+    temp = []
+    temp.append(hum_det[2])             # Human box
+    temp.append(obj_det[2])             # Object box
+    temp.append(obj_det[4])             # Object class
+    temp.append(hoi_prob.tolist())      # Score (600)
+    temp.append(hum_det[5])             # Human score
+    temp.append(obj_det[5])             # Object score
+    temp.append(bin_prob.tolist())      # binary score
+    return temp
+
+
+def test_image(model, im_obj_dets, image_size, det_obj2hoi_obj, obj2vec, pack_spa_maps=False, spa_map_in_model=False):
     # save image information
     results = []
-    spa_maps = torch.FloatTensor(1)
-    spa_maps = Variable(spa_maps).cuda()
 
     obj_class_num = obj2vec.shape[0]
-    obj_vecs = torch.zeros((1, obj_class_num))
+
+    boxes, max_scores, is_human = detections_to_arrays(im_obj_dets)
+    pair_hum_inds, pair_obj_inds = candidate_pairs(boxes, max_scores, is_human)
+    if len(pair_hum_inds) == 0:
+        return results
+
+    # all pairs of the image are scored with one forward
+    num_pair = len(pair_hum_inds)
+    pair_hboxes = boxes[pair_hum_inds]
+    pair_oboxes = boxes[pair_obj_inds]
+    obj_inds, pair_obj_inds_local = np.unique(pair_obj_inds, return_inverse=True)
+    obj_classes = np.array([det_obj2hoi_obj[im_obj_dets[obj_ind][4]] for obj_ind in obj_inds])
+    hum_inds, pair_hum_inds_local = np.unique(pair_hum_inds, return_inverse=True)
+    skeletons, skeleton_valid = skeletons_to_array([im_obj_dets[hum_ind][6] for hum_ind in hum_inds])
+    pose_feats = gen_pose_feats_batch(skeletons[pair_hum_inds_local], pair_oboxes,
+                                      skeleton_valid[pair_hum_inds_local])
+    if spa_map_in_model:
+        # raw boxes, rasterized inside SpaLan
+        spa_maps = np.concatenate((pair_hboxes, pair_oboxes), axis=1)
+    else:
+        spa_maps = gen_spatial_maps_batch(pair_hboxes, pair_oboxes)
+        if pack_spa_maps:
+            spa_maps = pack_spatial_maps(spa_maps)
+
+    obj_inds = torch.from_numpy(obj_classes[pair_obj_inds_local]).long()
+    obj_vecs = torch.zeros((num_pair, obj_class_num))
+    obj_vecs[torch.arange(num_pair).long(), obj_inds] = 1
+    spa_maps = Variable(torch.from_numpy(np.ascontiguousarray(spa_maps))).cuda()
     obj_vecs = Variable(obj_vecs).cuda()
+    obj_inds = Variable(obj_inds).cuda()
+    pose_vecs = Variable(torch.from_numpy(pose_feats)).cuda()
+
+    with torch.no_grad():
+        bin_prob, hoi_prob, _, _, _, _ = model(spa_maps, obj_vecs, pose_vecs, obj_inds=obj_inds)
+        if model.obj_hoi_ranges is not None:
+            hoi_prob = model.scatter_hoi_scores(hoi_prob, obj_inds)
+    hoi_prob = hoi_prob.cpu().data.numpy()
+    bin_prob = bin_prob.cpu().data.numpy()
 
-    pose_vecs = torch.zeros((1, 17))
-    pose_vecs = Variable(pose_vecs).cuda()
-
-    hum_thr = 0.8
-    obj_thr = 0.3
-
-    for hum_det in im_obj_dets:
-        if (np.max(hum_det[5]) > hum_thr) and (hum_det[1] == 'Human'):
-            # This is a valid human
-            hbox = hum_det[2]
-            hscore = hum_det[5]
-            skeleton = hum_det[6]
-            for obj_det in im_obj_dets:
-                if (np.max(obj_det[5]) > obj_thr) and not (np.all(obj_det[2] == hum_det[2])):
-                    # This is a valid object
-                    obox = obj_det[2]
-                    oscore = obj_det[5]
-                    oind = det_obj2hoi_obj[obj_det[4]]
-
-                    spa_map_raw = gen_spatial_map(hbox, obox, oind, 80)
-                    spa_map_raw = torch.from_numpy(spa_map_raw[np.newaxis, :, :, :])
-
-                    pose_feat_raw = gen_pose_feat(skeleton, obox)
-                    pose_feat_raw = torch.from_numpy(pose_feat_raw[np.newaxis, :, :, :])
-
-                    # ovec = torch.from_numpy(obj2vec[oind]).view((1, -1))
-                    # obj_vecs.data.resize_(ovec.size()).copy_(ovec)
-                    obj_vecs[0, oind] = 1
-                    spa_maps.data.resize_(spa_map_raw.size()).copy_(spa_map_raw)
-                    pose_feat_raw.data.resize_(pose_feat_raw.size()).copy_(pose_feat_raw)
-
-                    with torch.no_grad():
-                        bin_prob, hoi_prob, _, _, _, _ = model(spa_maps, obj_vecs, pose_vecs)
-
-                    temp = []
-                    temp.append(hum_det[2])             # Human box
-                    temp.append(obj_det[2])             # Object box
-                    temp.append(obj_det[4])             # Object class
-                    temp.append(hoi_prob.cpu().data.numpy()[0].tolist())            # Score (600)
-                    temp.append(hscore)                 # Human score
-                    temp.append(oscore)                 # Object score
-                    temp.append(bin_prob.cpu().data.numpy()[0].tolist())            # binary score
-                    results.append(temp)
+    for i, (hum_ind, obj_ind) in enumerate(zip(pair_hum_inds, pair_obj_inds)):
+        results.append(hoi_det_entry(im_obj_dets[hum_ind], im_obj_dets[obj_ind], hoi_prob[i], bin_prob[i]))
 
     return results
 
 
-def test(model, obj_det_db, image_set_info, det_obj2hoi_obj, obj2vec):
+def test(model, obj_det_db, image_set_info, det_obj2hoi_obj, obj2vec, pack_spa_maps=False, spa_map_in_model=False):
     all_results = {}
     num_im = len(obj_det_db)
+    # object branch becomes a class lookup, see SpaLan.compile_obj_branch
+    model.compile_obj_branch()
     for i, im_id in enumerate(obj_det_db):
         print('test [%d/%d]' % (i+1, num_im))
         image_size = image_set_info[im_id]
         im_obj_dets = obj_det_db[im_id]
-        im_hoi_dets = test_image(model, im_obj_dets, image_size, det_obj2hoi_obj, obj2vec)
+        im_hoi_dets = test_image(model, im_obj_dets, image_size, det_obj2hoi_obj, obj2vec,
+                                 pack_spa_maps, spa_map_in_model)
         all_results[im_id] = im_hoi_dets
     return all_results
 
 
+def test_stream(model, obj_det_db, det_obj2hoi_obj, obj2vec, pack_spa_maps=False, spa_map_in_model=False,
+                batch_size=4096, num_workers=4, obj_hoi_ranges=None):
+    # same results as test() in the columns of hoi_results, but the pairs of all images are scored
+    # in fixed size batches that ignore image boundaries, maps and pose features are built by DataLoader workers.
+    # With obj_hoi_ranges only the hoi classes of each pair's object are stored (range-sparse results)
+    print('Collecting pairs ...')
+    image_ids = list(obj_det_db.keys())
+    num_pairs = []
+    pair_hum_inds = []
+    hum_skeletons = []
+    pair_hboxes = []
+    pair_oboxes = []
+    pair_obj_classes = []
+    pair_det_classes = []
+    pair_hscores = []
+    pair_oscores = []
+    for im_id in image_ids:
+        im_obj_dets = obj_det_db[im_id]
+        boxes, max_scores, is_human = detections_to_arrays(im_obj_dets)
+        im_hum_inds, im_obj_inds = candidate_pairs(boxes, max_scores, is_human)
+        num_pairs.append(len(im_hum_inds))
+        if len(im_hum_inds) == 0:
+            continue
+        hum_inds, im_pair_hum_inds = np.unique(im_hum_inds, return_inverse=True)
+        pair_hum_inds.append(im_pair_hum_inds + len(hum_skeletons))
+        hum_skeletons.extend(im_obj_dets[hum_ind][6] for hum_ind in hum_inds)
+        pair_hboxes.append(boxes[im_hum_inds])
+        pair_oboxes.append(boxes[im_obj_inds])
+        obj_inds, im_pair_obj_inds = np.unique(im_obj_inds, return_inverse=True)
+        obj_classes = np.array([det_obj2hoi_obj[im_obj_dets[obj_ind][4]] for obj_ind in obj_inds])
+        pair_obj_classes.append(obj_classes[im_pair_obj_inds])
+        pair_det_classes.append([im_obj_dets[obj_ind][4] for obj_ind in im_obj_inds])
+        pair_hscores.append([im_obj_dets[hum_ind][5] for hum_ind in im_hum_inds])
+        pair_oscores.append([im_obj_dets[obj_ind][5] for obj_ind in im_obj_inds])
+
+    hoi_scores = []
+    bin_scores = []
+    pair_hoi_ranges = None
+    if sum(num_pairs) > 0:
+        pair_obj_classes = np.concatenate(pair_obj_classes)
+        if obj_hoi_ranges is not None:
+            pair_hoi_ranges = np.array(obj_hoi_ranges)[pair_obj_classes]
+        skeletons, skeleton_valid = skeletons_to_array(hum_skeletons)
+        dataset = HICOTestPairDataset(np.concatenate(pair_hboxes), np.concatenate(pair_oboxes),
+                                      pair_obj_classes, np.concatenate(pair_hum_inds),
+                                      skeletons, skeleton_valid, obj2vec.shape[0], pack_spa_maps, spa_map_in_model)
+        dataloader = DataLoader(dataset, batch_sampler=HICOBatchSampler(len(dataset), batch_size, shuffle=False),
+                                collate_fn=collate_hico_test_pairs, num_workers=num_workers)
+
+        # object branch becomes a class lookup, see SpaLan.compile_obj_branch
+        model.compile_obj_branch()
+        num_batch = len(dataloader)
+        for batch_ind, (spa_maps, obj_vecs, obj_inds, pose_feats, pair_inds) in enumerate(dataloader):
+            print('test [%d/%d]' % (batch_ind + 1, num_batch))
+            spa_maps = Variable(spa_maps).cuda()
+            obj_vecs = Variable(obj_vecs).cuda()
+            obj_inds = Variable(obj_inds).cuda()
+            pose_vecs = Variable(pose_feats).cuda()
+            with torch.no_grad():
+                bin_prob, hoi_prob, _, _, _, _ = model(spa_maps, obj_vecs, pose_vecs, obj_inds=obj_inds)
+                if model.obj_hoi_ranges is not None:
+                    hoi_prob = model.scatter_hoi_scores(hoi_prob, obj_inds)
+            # batches come in pair order, so every image keeps the pair order of test_image
+            hoi_prob = hoi_prob.cpu().data.numpy()
+            if pair_hoi_ranges is not None:
+                hoi_prob = gather_range_scores(hoi_prob, pair_hoi_ranges[pair_inds.numpy()])
+            hoi_scores.append(hoi_prob.astype(np.float16))
+            bin_scores.append(bin_prob.cpu().data.numpy())
+
+    return pack_hoi_results(image_ids, num_pairs, pair_hboxes, pair_oboxes, pair_det_classes, hoi_scores,
+                            pair_hscores, pair_oscores, bin_scores, model.num_hoi_class, pair_hoi_ranges)
+
+
 if __name__ == '__main__':
     config_path = 'hico_spa.yaml'
     with open(config_path) as f:
@@ -94,22 +179,25 @@ if __name__ == '__main__':
     if not os.path.exists(output_dir):
         os.mkdir(output_dir)
 
-    output_path = os.path.join(output_dir, 'all_hoi_detections.pkl')
-    if not os.path.exists(output_path):
+    output_path = os.path.join(output_dir, 'all_hoi_detections')
+    results = output_path
+    if not hoi_results_exist(output_path):
+        data_root = '../data/hico'
+        hoi_classes_path = os.path.join(data_root, 'hoi_categories.pkl')
+        hoi_classes, obj_classes, vrb_classes, hoi2int = load_hoi_classes(hoi_classes_path)
+
         print('Loading models ...')
         model_save_dir = config['model_save_dir']
+        obj_hoi_ranges = object_hoi_ranges(hoi_classes, obj_classes, hoi2int)
         model = SpaLan(config['spa_feature_dim'],
                        config['num_hoi_classes'],
                        config['num_obj_classes'],
-                       config['num_key_points'])
+                       config['num_key_points'],
+                       obj_hoi_ranges if config['sparse_hoi_heads'] else None)
         model = model.cuda()
         resume_dict = torch.load(os.path.join(model_save_dir, '%s_99_weights.pkl' % model))
         model.load_state_dict(resume_dict)
         model.eval()
-
-        data_root = '../data/hico'
-        hoi_classes_path = os.path.join(data_root, 'hoi_categories.pkl')
-        hoi_classes, obj_classes, vrb_classes, hoi2int = load_hoi_classes(hoi_classes_path)
         det_obj2hoi_obj = object_class_mapping(hoi_classes, obj_classes)
         image_set_info = load_image_info(os.path.join(data_root, 'anno_bbox_full.mat'),
                                          config['data_save_dir'], image_set='test')
@@ -123,14 +211,17 @@ if __name__ == '__main__':
             obj_det_db = pickle.load(f)
 
         print('Testing ...')
-        all_results = test(model, obj_det_db, image_set_info, det_obj2hoi_obj, obj2vec)
+        results = test_stream(model, obj_det_db, det_obj2hoi_obj, obj2vec,
+                              config['pack_spa_maps'], config['spa_map_in_model'],
+                              config['test_batch_size'], config['test_num_workers'],
+                              obj_hoi_ranges if config['range_hoi_results'] else None)
 
         print('Saving results ...')
-        with open(output_path, 'wb') as f:
-            pickle.dump(all_results, f)
+        save_hoi_results(results, output_path)
         print('Done.')
 
-    generate_HICO_detection(output_path, 'output/results', 1.0, 0)
-
-    os.chdir('benchmark')
-    os.system('matlab -nodesktop -nosplash -r "Generate_detection '+ '../output/results/' + '/;quit;"')
+    # eval_result.txt, and the detections_XX.mat for submission: from the same pass, or by export_num_workers
+    # processes reading the saved results
+    eval_HICO_results(output_path if config['export_mat'] and config['export_num_workers'] > 0 else results,
+                      [(1.0, 0)], HICO_dirs=['output/results'], export_mat=config['export_mat'],
+                      num_workers=config['export_num_workers'])
@@ -9,8 +9,8 @@ from torch.autograd import Variable
 from torch.utils.data import DataLoader
 from tensorboardX import SummaryWriter
 
-from dataset import HICODatasetSpa
-from load_data import prepare_hico, load_hoi_classes
+from dataset import HICODatasetSpa, HICOBatchSampler, collate_hico_batch
+from load_data import prepare_hico, load_hoi_classes, object_hoi_ranges
 from model import SpaLan
 from val import val
 
@@ -31,19 +31,31 @@ def main(data_root, config):
         os.mkdir(model_save_dir)
 
     print('===== preparing =====')
-    hoi_db = prepare_hico(data_root, data_save_dir)
-    test_dataset = HICODatasetSpa(hoi_db['val'])
-    test_dataloader = DataLoader(test_dataset, batch_size=32, shuffle=True)
-    train_dataset = HICODatasetSpa(hoi_db['train'])
-    train_dataloader = DataLoader(train_dataset, batch_size=32, shuffle=True)
+    pack_spa_maps = config['pack_spa_maps']
+    spa_map_in_model = config['spa_map_in_model']
+    hoi_db = prepare_hico(data_root, data_save_dir, pack_spa_maps, not spa_map_in_model)
+    test_dataset = HICODatasetSpa(hoi_db['val'], pack_spa_maps, spa_map_in_model)
+    test_sampler = HICOBatchSampler(len(test_dataset), 32, shuffle=True, bin_classes=test_dataset.bin_classes,
+                                    neg_ratio=config['neg_ratio'], seed=0,
+                                    image_ids=test_dataset.image_ids)
+    test_dataloader = DataLoader(test_dataset, batch_sampler=test_sampler, collate_fn=collate_hico_batch)
+    train_dataset = HICODatasetSpa(hoi_db['train'], pack_spa_maps, spa_map_in_model)
+    train_sampler = HICOBatchSampler(len(train_dataset), 32, shuffle=True, bin_classes=train_dataset.bin_classes,
+                                     neg_ratio=config['neg_ratio'],
+                                     image_ids=train_dataset.image_ids)
+    train_dataloader = DataLoader(train_dataset, batch_sampler=train_sampler, collate_fn=collate_hico_batch)
     hoi_classes_path = os.path.join(data_root, 'hoi_categories.pkl')
-    hoi_classes, _, _, hoi2int = load_hoi_classes(hoi_classes_path)
+    hoi_classes, obj_classes, _, hoi2int = load_hoi_classes(hoi_classes_path)
     print('===== done =====')
 
+    obj_hoi_ranges = None
+    if config['sparse_hoi_heads']:
+        obj_hoi_ranges = object_hoi_ranges(hoi_classes, obj_classes, hoi2int)
     model = SpaLan(config['spa_feature_dim'],
                    config['num_hoi_classes'],
                    config['num_obj_classes'],
-                   config['num_key_points'])
+                   config['num_key_points'],
+                   obj_hoi_ranges)
     model = model.cuda()
 
     # Optimizer
@@ -10,7 +10,7 @@ from torch.utils.data import DataLoader
 from torch.autograd import Variable
 
 from load_data import prepare_hico, load_hoi_classes
-from dataset import HICODatasetSpa
+from dataset import HICODatasetSpa, HICOBatchSampler, collate_hico_batch
 from model import SpaLan
 
 
@@ -50,6 +50,8 @@ def val(model, dataset, hoi_classes, hoi2int, show=False):
         loss_bin, loss_hoi, \
         error_bin, error_hoi = model(spa_maps, obj_cates, pose_feats, hoi_cates, bin_cates, pos_mask)
         num_ins = spa_maps.shape[0]
+        if show and model.obj_hoi_ranges is not None:
+            hoi_prob = model.scatter_hoi_scores(hoi_prob, torch.max(obj_cates, 1)[1])
         error_bin_all += error_bin.data.item()
         error_hoi_all += error_hoi.data.item()
 
@@ -100,9 +102,12 @@ if __name__ == '__main__':
     hoi_classes, obj_classes, vrb_classes, hoi2int, obj2int = load_hoi_classes(hoi_classes_path)
 
     data_save_dir = config['data_save_dir']
-    hoi_db = prepare_hico(data_root, data_save_dir)
-    test_dataset = HICODatasetSpa(hoi_db['val'])
-    dataloader = DataLoader(test_dataset, batch_size=32, shuffle=True)
+    hoi_db = prepare_hico(data_root, data_save_dir, config['pack_spa_maps'], not config['spa_map_in_model'])
+    test_dataset = HICODatasetSpa(hoi_db['val'], config['pack_spa_maps'], config['spa_map_in_model'])
+    test_sampler = HICOBatchSampler(len(test_dataset), 32, shuffle=True, bin_classes=test_dataset.bin_classes,
+                                    neg_ratio=config['neg_ratio'], seed=0,
+                                    image_ids=test_dataset.image_ids)
+    dataloader = DataLoader(test_dataset, batch_sampler=test_sampler, collate_fn=collate_hico_batch)
 
     print('Loading models ...')
     model_save_dir = config['model_save_dir']
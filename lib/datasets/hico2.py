@@ -68,6 +68,15 @@ def iou(box1, box2):
     return iou
 
 
+def class_ids_to_csr(class_ids):
+    # list of per-pair class id lists -> (M,) int16 class ids and (N+1,) int64 row offsets
+    lengths = np.array([len(ids) for ids in class_ids], dtype=np.int64)
+    offsets = np.zeros(len(class_ids) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    inds = np.array([ind for ids in class_ids for ind in ids], dtype=np.int16)
+    return inds, offsets
+
+
 class hoi_class:
     def __init__(self, object_name, verb_name, hoi_id):
         self._object_name = object_name
@@ -178,7 +187,7 @@ class hico2(imdb):
         return os.path.join(cfg.DATA_DIR, 'hico')
 
     def gt_roidb(self):
-        cache_file = os.path.join(self.cache_path, self.name + '_gt_roidb.pkl')
+        cache_file = os.path.join(self.cache_path, self.name + '_gt_roidb_all_neg_csr.pkl')
         if os.path.exists(cache_file):
             with open(cache_file, 'rb') as fid:
                 gt_roidb_dict = pickle.load(fid)
@@ -211,20 +220,8 @@ class hico2(imdb):
         image_id_template = 'HICO_train2015_%s'
         for image_id, img_pos_hois in anno_gt_db.items():
             image_name = image_id_template % str(image_id).zfill(8)
-            if image_id in anno_ng_db and len(anno_ng_db[image_id]) > 0:
-                img_neg_hois0 = anno_ng_db[image_id]
-                if len(img_neg_hois0) > len(img_pos_hois):
-                    inds = random.sample(range(len(img_neg_hois0)), len(img_pos_hois))
-                else:
-                    inds = []
-                    for i in range(int(len(img_pos_hois) / len(img_neg_hois0))):
-                        inds += range(len(img_neg_hois0))
-                    for i in range(len(img_pos_hois) - len(inds)):
-                        inds.append(i)
-                img_neg_hois = [img_neg_hois0[ind] for ind in inds]
-                assert len(img_neg_hois) == len(img_pos_hois)
-            else:
-                img_neg_hois = []
+            # keep every negative, roibatchLoader samples them per image load
+            img_neg_hois = anno_ng_db.get(image_id, [])
 
             # boxes: x1, y1, x2, y2
             image_anno = {'hboxes': [],
@@ -263,38 +260,30 @@ class hico2(imdb):
                         # negative - 1
                         image_anno['bin_classes'].append(1)
 
-            # list -> np.array
+            # list -> np.array, the (mostly negative) pairs keep their hoi class ids in CSR layout and
+            # a 0 (positive) / 1 (negative) label, roibatchLoader densifies the pairs it samples
+            hoi_class_inds, hoi_class_offsets = class_ids_to_csr(image_anno.pop('hoi_classes'))
+            image_anno['hoi_class_inds'] = hoi_class_inds
+            image_anno['hoi_class_offsets'] = hoi_class_offsets
+            image_anno['bin_classes'] = np.array(image_anno['bin_classes'], dtype=np.uint8)
             if len(image_anno['hboxes']) == 0:
                 image_anno['hboxes'] = np.zeros((0, 4))
                 image_anno['oboxes'] = np.zeros((0, 4))
                 image_anno['iboxes'] = np.zeros((0, 4))
                 image_anno['obj_classes'] = np.zeros(0)
-                image_anno['bin_classes'] = np.zeros(0, 2)
-                image_anno['hoi_classes'] = np.zeros((0, self.num_classes))
             else:
                 image_anno['hboxes'] = np.array(image_anno['hboxes'])
                 image_anno['oboxes'] = np.array(image_anno['oboxes'])
                 image_anno['iboxes'] = np.array(image_anno['iboxes'])
                 image_anno['obj_classes'] = np.array(image_anno['obj_classes'])
-
-                bin_classes = image_anno['bin_classes']
-                image_anno['bin_classes'] = np.zeros((len(bin_classes), 2))
-                for i, ins_class in enumerate(bin_classes):
-                    image_anno['bin_classes'][i, ins_class] = 1
-
-                hoi_classes = image_anno['hoi_classes']
-                image_anno['hoi_classes'] = np.zeros((len(hoi_classes), self.num_classes))
-                for i, ins_classes in enumerate(hoi_classes):
-                    for cls in ins_classes:
-                        image_anno['hoi_classes'][i, cls] = 1
         return all_annos
 
     def append_flipped_images(self):
-        import copy
         num_images = len(self.roidb)
         widths = [self.roidb[i]['width'] for i in range(num_images)]
         for i in range(num_images):
-            new_entry = copy.deepcopy(self.roidb[i])
+            # the class arrays are never written to, the flipped entry shares them
+            new_entry = dict(self.roidb[i])
             new_entry['flipped'] = True
 
             box_types = ['hboxes', 'oboxes', 'iboxes']
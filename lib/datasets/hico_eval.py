@@ -0,0 +1,199 @@
+"""HICO-DET Default setting pair AP, the benchmark/evaluation MATLAB code in NumPy."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import scipy.io as sio
+
+
+# port of benchmark/evaluation/eval_run.m + VOCevaldet_bboxpair.m, Default setting:
+# per hoi class 11 point AP of (human box, object box) pairs, a pair hits a gt pair when
+# min(human IoU, object IoU) >= MIN_OVERLAP
+MIN_OVERLAP = 0.5
+# recall thresholds of the 11 point AP, built like MATLAB builds 0:0.1:1 (from both ends),
+# so rec >= t compares against the same doubles
+AP_RECALL_THRESHOLDS = [k * 0.1 for k in range(5)] + [0.5] + [1 - k * 0.1 for k in range(4, -1, -1)]
+# hoi classes with fewer training instances are "rare"
+RARE_THRESHOLD = 10
+
+
+def _mat_boxes(mat_boxes):
+  # (1,k) struct array of x1, y1, x2, y2 -> (k,4) boxes
+  return np.array([[float(box[field][0, 0]) for field in ('x1', 'y1', 'x2', 'y2')]
+                   for box in mat_boxes[0]]).reshape(-1, 4)
+
+
+def _visible_hois(mat_anno):
+  # (hoi id, (m,8) human + object boxes of the connections) of the visible hois of an image
+  hois = mat_anno['hoi']
+  for j in range(hois.shape[1]):
+    hoi = hois[0, j]
+    if int(hoi['invis'][0, 0]) == 1:
+      continue
+    conn = np.asarray(hoi['connection'], dtype=np.int64).reshape(-1, 2)
+    bbox_h = _mat_boxes(hoi['bboxhuman'])
+    bbox_o = _mat_boxes(hoi['bboxobject'])
+    yield int(hoi['id'][0, 0]), np.hstack((bbox_h[conn[:, 0] - 1], bbox_o[conn[:, 1] - 1]))
+
+
+def load_hico_gt(bbox_path, image_set='test', num_hoi_class=600):
+  # anno_bbox.mat -> gt pairs of every hoi class, loaded once for any number of evaluations:
+  # image_ids (image index order), boxes / image_inds (gt pairs of hoi class c and their image
+  # index, in image order), rare (hoi classes with < RARE_THRESHOLD training instances)
+  print('Loading HICO-DET ground truth ...')
+  mat_anno_db = sio.loadmat(bbox_path)
+
+  image_ids = []
+  hoi_boxes = [[] for _ in range(num_hoi_class)]
+  hoi_image_inds = [[] for _ in range(num_hoi_class)]
+  for i, mat_anno in enumerate(mat_anno_db['bbox_%s' % image_set][0, :]):
+    image_ids.append(int(mat_anno['filename'][0].split('.')[0][-8:]))
+    # like gt_all{hoi_id, i} = boxes, a hoi listed twice in an image keeps its last entry
+    image_hois = {}
+    for hoi_id, boxes in _visible_hois(mat_anno):
+      image_hois[hoi_id] = boxes
+    for hoi_id, boxes in image_hois.items():
+      hoi_boxes[hoi_id - 1].append(boxes)
+      hoi_image_inds[hoi_id - 1].append(np.full(len(boxes), i, dtype=np.int64))
+
+  num_inst = np.zeros(num_hoi_class, dtype=np.int64)
+  for mat_anno in mat_anno_db['bbox_train'][0, :]:
+    for hoi_id, boxes in _visible_hois(mat_anno):
+      num_inst[hoi_id - 1] += len(boxes)
+
+  return {
+    'image_ids': np.array(image_ids, dtype=np.int64),
+    'boxes': [np.concatenate(boxes) if len(boxes) > 0 else np.zeros((0, 8)) for boxes in hoi_boxes],
+    'image_inds': [np.concatenate(inds) if len(inds) > 0 else np.zeros(0, dtype=np.int64)
+                   for inds in hoi_image_inds],
+    'rare': num_inst < RARE_THRESHOLD,
+  }
+
+
+def mat_round(x):
+  # MATLAB round(): halves away from zero
+  x = np.asarray(x, dtype=np.float64)
+  return np.sign(x) * np.floor(np.abs(x) + 0.5)
+
+
+def _pair_iou(boxes, gt_boxes):
+  # row by row IoU with the +1 pixel convention, 0 when the boxes do not intersect
+  iw = np.minimum(boxes[:, 2], gt_boxes[:, 2]) - np.maximum(boxes[:, 0], gt_boxes[:, 0]) + 1
+  ih = np.minimum(boxes[:, 3], gt_boxes[:, 3]) - np.maximum(boxes[:, 1], gt_boxes[:, 1]) + 1
+  ua = (boxes[:, 2] - boxes[:, 0] + 1) * (boxes[:, 3] - boxes[:, 1] + 1) + \
+    (gt_boxes[:, 2] - gt_boxes[:, 0] + 1) * (gt_boxes[:, 3] - gt_boxes[:, 1] + 1) - iw * ih
+  with np.errstate(divide='ignore', invalid='ignore'):
+    ov = iw * ih / ua
+  return np.where((iw > 0) & (ih > 0), ov, 0.)
+
+
+def hoi_pair_ap(gt_boxes, gt_image_inds, det_boxes, det_image_inds, det_scores, min_overlap=MIN_OVERLAP):
+  # VOCevaldet_bboxpair.m without the loops -> (ap, last recall).
+  # det_boxes: (D,8) one-based human + object boxes in the order eval_run.m collects them (image
+  # index, then file order), ties in score keep that order. Every detection goes to the gt pair of
+  # its image with the largest min IoU (first one on ties), a gt pair is a hit only for its first detection
+  npos = len(gt_image_inds)
+  nd = len(det_scores)
+  if nd == 0:
+    return 0., 0.
+
+  order = np.argsort(-np.asarray(det_scores, dtype=np.float64), kind='stable')
+  det_boxes = np.asarray(det_boxes, dtype=np.float64)[order]
+  det_image_inds = np.asarray(det_image_inds)[order]
+
+  # every (detection, gt pair of its image), gt_image_inds is sorted
+  gt_starts = np.searchsorted(gt_image_inds, det_image_inds, 'left')
+  counts = np.searchsorted(gt_image_inds, det_image_inds, 'right') - gt_starts
+  pair_starts = np.cumsum(counts) - counts
+  pair_det_inds = np.repeat(np.arange(nd), counts)
+  pair_gt_inds = np.arange(counts.sum()) + np.repeat(gt_starts - pair_starts, counts)
+
+  # min over the two boxes, NaN ignored like MATLAB min()
+  ov = np.fmin(_pair_iou(det_boxes[pair_det_inds, :4], gt_boxes[pair_gt_inds, :4]),
+               _pair_iou(det_boxes[pair_det_inds, 4:], gt_boxes[pair_gt_inds, 4:]))
+  ov_max = np.full(nd, -np.inf)
+  has_gt = counts > 0
+  if has_gt.any():
+    ov_max[has_gt] = np.fmax.reduceat(ov, pair_starts[has_gt])
+  is_max = ov == ov_max[pair_det_inds]
+  max_dets, first = np.unique(pair_det_inds[is_max], return_index=True)
+  j_max = np.full(nd, -1, dtype=np.int64)
+  j_max[max_dets] = pair_gt_inds[is_max][first]
+
+  hits = np.nonzero(ov_max >= min_overlap)[0]
+  _, first_hits = np.unique(j_max[hits], return_index=True)
+  tp = np.zeros(nd)
+  tp[hits[first_hits]] = 1
+  fp = 1 - tp
+
+  fp = np.cumsum(fp)
+  tp = np.cumsum(tp)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    rec = tp / float(npos)
+  prec = tp / (fp + tp)
+
+  ap = 0.
+  for t in AP_RECALL_THRESHOLDS:
+    p = prec[rec >= t]
+    ap += (p.max() if len(p) > 0 else 0.) / 11
+  return ap, rec[-1]
+
+
+def hoi_detection_aps(gt, hoi_ids, image_ids, hboxes, oboxes, scores, min_overlap=MIN_OVERLAP):
+  # (hoi_ids, image_ids, hboxes, oboxes, scores) columns holding all the detections of their hoi classes
+  # (hoi ids are 1-based, boxes as exported), e.g. one object class -> {hoi index: (ap, last recall)}.
+  # Boxes are rounded and made one-based like Generate_detection.m
+  hoi_ids = np.asarray(hoi_ids)
+  if len(hoi_ids) == 0:
+    return {}
+  id_order = np.argsort(gt['image_ids'])
+  sorted_ids = gt['image_ids'][id_order]
+  pos = np.searchsorted(sorted_ids, image_ids)
+  assert (sorted_ids[np.minimum(pos, len(sorted_ids) - 1)] == image_ids).all(), 'image not in the gt'
+  image_inds = id_order[pos]
+  boxes = mat_round(np.hstack((np.reshape(hboxes, (-1, 4)), np.reshape(oboxes, (-1, 4))))) + 1
+  scores = np.asarray(scores, dtype=np.float64)
+
+  aps = {}
+  # detections of a hoi class in image index order, file order within an image
+  order = np.argsort(image_inds, kind='stable')
+  for hoi_id in np.unique(hoi_ids):
+    inds = order[hoi_ids[order] == hoi_id]
+    c = int(hoi_id) - 1
+    aps[c] = hoi_pair_ap(gt['boxes'][c], gt['image_inds'][c],
+                         boxes[inds], image_inds[inds], scores[inds], min_overlap)
+  return aps
+
+
+def eval_hoi_detections(gt, detections, min_overlap=MIN_OVERLAP):
+  # detections: iterable of hoi_detection_aps columns, e.g. one item per object class -> AP, REC per hoi class
+  num_hoi_class = len(gt['boxes'])
+  AP = np.zeros(num_hoi_class)
+  REC = np.zeros(num_hoi_class)
+  for columns in detections:
+    for c, (ap, rec) in hoi_detection_aps(gt, *columns, min_overlap=min_overlap).items():
+      AP[c], REC[c] = ap, rec
+  return AP, REC
+
+
+def hoi_map(gt, AP, REC):
+  # eval_run.m summary: (mAP, mRec) of the full, rare and non-rare hoi classes
+  rare = gt['rare']
+  return {
+    'full': (np.mean(AP), np.mean(REC)),
+    'rare': (np.mean(AP[rare]), np.mean(REC[rare])),
+    'non_rare': (np.mean(AP[~rare]), np.mean(REC[~rare])),
+  }
+
+
+def format_hoi_map(hoi_mAP, eval_mode='def'):
+  lines = ['',
+           'setting:     %s' % eval_mode,
+           '',
+           '  mAP / mRec (full):      %.4f / %.4f' % hoi_mAP['full'],
+           '',
+           '  mAP / mRec (rare):      %.4f / %.4f' % hoi_mAP['rare'],
+           '  mAP / mRec (non-rare):  %.4f / %.4f' % hoi_mAP['non_rare'],
+           '']
+  return '\n'.join(lines) + '\n'
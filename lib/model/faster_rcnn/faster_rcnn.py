@@ -15,6 +15,7 @@ from model.rpn.proposal_target_layer_cascade import _ProposalTargetLayer
 import time
 import pdb
 from model.utils.net_utils import _smooth_l1_loss, _crop_pool_layer, _affine_grid_gen, _affine_theta
+from model.utils.spa_rasterizer import SpaMapRasterizer
 
 
 class SpaConv(nn.Module):
@@ -60,6 +61,7 @@ class _fasterRCNN(nn.Module):
 
         self.grid_size = cfg.POOLING_SIZE * 2 if cfg.CROP_RESIZE_WITH_MAX_POOL else cfg.POOLING_SIZE
         self.RCNN_roi_crop = _RoICrop()
+        self.spa_rasterizer = SpaMapRasterizer()
         self.spa_cls_CNN = SpaConv()
         self.spa_bin_CNN = SpaConv()
 
@@ -74,6 +76,13 @@ class _fasterRCNN(nn.Module):
         iboxes = iboxes.data
         num_hois = num_hois.data
 
+        if cfg.SPA_MAP_IN_MODEL:
+            # spa_maps carries the (human, object) boxes gen_spatial_maps_batch used to get: unscaled
+            # at test time, uncropped in training. hboxes/oboxes are scaled (and cropped), bbox_trans is not
+            # scale-invariant, so the interaction maps are rasterized from those boxes
+            spa_boxes = spa_maps.data.contiguous().view(-1, 8)
+            spa_maps = self.spa_rasterizer(spa_boxes[:, :4], spa_boxes[:, 4:]).view(batch_size, -1, 2, 64, 64)
+
         # feed image data to base model to obtain base feature map
         base_feat = self.RCNN_base(im_data)
 
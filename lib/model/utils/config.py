@@ -89,6 +89,10 @@ __C.TRAIN.BG_THRESH_LO = 0.1
 # Use horizontally-flipped images during training?
 __C.TRAIN.USE_FLIPPED = True
 
+# Negative human-object pairs drawn per positive pair of an image, resampled every
+# time the image is loaded from all of its negative pairs
+__C.TRAIN.HOI_NEG_RATIO = 1.0
+
 # Train bounding-box regressors
 __C.TRAIN.BBOX_REG = True
 
@@ -205,6 +209,9 @@ __C.TEST.MODE = 'nms'
 # Only useful when TEST.MODE is 'top', specifies the number of top proposals to select
 __C.TEST.RPN_TOP_N = 5000
 
+# Store only the hoi classes of each pair's object in the results (range-sparse scores)
+__C.TEST.RANGE_HOI_RESULTS = False
+
 #
 # ResNet options
 #
@@ -301,6 +308,10 @@ __C.CUDA = False
 
 __C.CROP_RESIZE_WITH_MAX_POOL = True
 
+# Rasterize the human-object spatial maps inside the network instead of generating them
+# in the data loader, the loader then passes the unscaled (human, object) boxes as spa_maps
+__C.SPA_MAP_IN_MODEL = False
+
 import pdb
 def get_output_dir(imdb, weights_filename):
   """Return the directory where experimental artifacts are placed.
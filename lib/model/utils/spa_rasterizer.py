@@ -0,0 +1,92 @@
+"""In-network rasterization of human/object boxes into the interaction maps of bbox_trans."""
+import numpy as np
+import torch
+import torch.nn as nn
+
+
+def _slice_bounds(inds, size):
+    # python slice semantics: negative indices count from the end, then clip to [0, size]
+    inds = torch.where(inds < 0, inds + size, inds)
+    return inds.clamp(0, size)
+
+
+class SpaMapRasterizer(nn.Module):
+    # in-network version of dataset.gen_spatial_maps_batch: (N,4) human and object boxes -> (N,2,64,64) maps
+    def __init__(self, size=64):
+        super(SpaMapRasterizer, self).__init__()
+        self.size = size
+
+    def forward(self, hboxes, oboxes):
+        size = self.size
+        hboxes = hboxes.contiguous().view(-1, 4)
+        oboxes = oboxes.contiguous().view(-1, 4)
+        if hboxes.dtype != oboxes.dtype or hboxes.dtype not in (torch.float32, torch.float64):
+            hboxes = hboxes.double()
+            oboxes = oboxes.double()
+        dtype = hboxes.dtype
+
+        union_x1 = torch.min(hboxes[:, 0], oboxes[:, 0])
+        union_y1 = torch.min(hboxes[:, 1], oboxes[:, 1])
+        union_x2 = torch.max(hboxes[:, 2], oboxes[:, 2])
+        union_y2 = torch.max(hboxes[:, 3], oboxes[:, 3])
+        height = union_y2 - union_y1 + 1
+        width = union_x2 - union_x1 + 1
+        ratio_height = height > width
+        ratio_width = height <= width
+        scale = torch.where(ratio_height, height, width)
+
+        # the longer side is mapped onto [0, size - 1]
+        full = torch.full_like(scale, size - 1)
+        x_max = torch.where(ratio_height, size * width / height - 1, full)
+        y_max = torch.where(ratio_height, full, size * height / width - 1)
+        trans_boxes = []
+        for box in (hboxes, oboxes):
+            trans_boxes.append([0 + size * (box[:, 0] - union_x1) / scale,
+                                0 + size * (box[:, 1] - union_y1) / scale,
+                                x_max - size * (width - 1 - (box[:, 2] - union_x1)) / scale,
+                                y_max - size * (height - 1 - (box[:, 3] - union_y1)) / scale])
+        hbox, obox = trans_boxes
+
+        # center the shorter side
+        union_max = torch.where(ratio_height, torch.max(hbox[2], obox[2]), torch.max(hbox[3], obox[3]))
+        shift = size / 2 - (union_max + 1) / 2
+
+        human_longer = torch.where(ratio_height, hbox[3] > obox[3], hbox[2] > obox[2])
+        object_longer = human_longer == 0
+        hbox[3] = torch.where(ratio_height & human_longer, full, hbox[3])
+        obox[3] = torch.where(ratio_height & object_longer, full, obox[3])
+        hbox[2] = torch.where(ratio_width & human_longer, full, hbox[2])
+        obox[2] = torch.where(ratio_width & object_longer, full, obox[2])
+
+        # same precision as bbox_trans: the shift is added in float64 and only written back
+        # to the box dtype on the 'height' branch
+        zeros = torch.zeros_like(shift).double()
+        shift_x = torch.where(ratio_height, shift.double(), zeros)
+        shift_y = torch.where(ratio_height, zeros, shift.double())
+        coords = []
+        for box in (hbox, obox):
+            for i, box_shift in enumerate((shift_x, shift_y, shift_x, shift_y)):
+                shifted = box[i].double() + box_shift
+                shifted = torch.where(ratio_height, shifted.to(dtype).double(), shifted)
+                coords.append(torch.round(shifted).long())
+        coords = torch.stack(coords, dim=1).view(-1, 2, 4)
+
+        inds = torch.arange(size, device=coords.device).long()
+        x1 = _slice_bounds(coords[:, :, 0], size).unsqueeze(2)
+        y1 = _slice_bounds(coords[:, :, 1], size).unsqueeze(2)
+        x2 = _slice_bounds(coords[:, :, 2] + 1, size).unsqueeze(2)
+        y2 = _slice_bounds(coords[:, :, 3] + 1, size).unsqueeze(2)
+        rows = (inds >= y1) & (inds < y2)
+        cols = (inds >= x1) & (inds < x2)
+        return (rows.unsqueeze(3) & cols.unsqueeze(2)).float()
+
+
+def spa_map_mismatches(hboxes, oboxes, gen_spatial_maps_batch, size=64):
+    # CPU parity check of SpaMapRasterizer against the numpy gen_spatial_maps_batch it replaces
+    # (exp/dataset.py, roi_data_layer/roibatchLoader.py): indices of the pairs whose maps differ.
+    # The boxes are passed with their dtype, bbox_trans rounds float32 and float64 boxes differently
+    hboxes = np.asarray(hboxes).reshape(-1, 4)
+    oboxes = np.asarray(oboxes).reshape(-1, 4)
+    ref_maps = gen_spatial_maps_batch(hboxes, oboxes, size)
+    maps = SpaMapRasterizer(size)(torch.from_numpy(hboxes), torch.from_numpy(oboxes)).numpy()
+    return np.nonzero((maps != ref_maps).reshape(len(ref_maps), -1).any(axis=1))[0]
@@ -0,0 +1,25 @@
+"""Candidate human-object pairs of an image's object detections."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+
+def detections_to_arrays(im_obj_dets):
+  # an image's object detections as arrays: (D,4) boxes, (D,) max scores, (D,) human flags
+  boxes = np.array([det[2] for det in im_obj_dets]).reshape(-1, 4)
+  max_scores = np.array([np.max(det[5]) for det in im_obj_dets], dtype=np.float64)
+  is_human = np.array([det[1] == 'Human' for det in im_obj_dets], dtype=bool)
+  return boxes, max_scores, is_human
+
+
+def candidate_pairs(boxes, max_scores, is_human, hum_thr=0.8, obj_thr=0.3):
+  # detection indices (P,) of the human and the object of every candidate pair: thresholds as masks,
+  # then the (H,O) grid without the pairs of a human with its own box.
+  # Pairs come human-major, in the order of the nested loops over the detections
+  hum_inds = np.nonzero((max_scores > hum_thr) & is_human)[0]
+  obj_inds = np.nonzero(max_scores > obj_thr)[0]
+  not_self = np.any(boxes[hum_inds][:, np.newaxis, :] != boxes[obj_inds][np.newaxis, :, :], axis=2)
+  pair_hum_inds, pair_obj_inds = np.nonzero(not_self)
+  return hum_inds[pair_hum_inds], obj_inds[pair_obj_inds]
@@ -0,0 +1,167 @@
+"""Columnar HOI results store shared by the test scripts and generate_HICO_detection (lib and exp/)."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import json
+import pickle
+
+import numpy as np
+
+
+# columnar results store, the handoff between testing and generate_HICO_detection:
+# a row per candidate pair in every column except image_ids/offsets,
+# the pairs of image_ids[k] are the rows offsets[k]:offsets[k+1]
+RESULT_FIELDS = ('image_ids', 'offsets', 'hboxes', 'oboxes', 'obj_classes',
+                 'hoi_scores', 'hscores', 'oscores', 'bin_scores')
+# range-sparse stores keep only the hoi classes of each pair's object: hoi_scores is flat,
+# pair k owns hoi_scores[hoi_score_offsets[k]:hoi_score_offsets[k+1]], starting at class hoi_begins[k]
+RANGE_FIELDS = ('hoi_begins', 'hoi_score_offsets')
+
+
+def _column(data, num_pair, dtype, width=None):
+  # one array or a list of per-image chunks -> (num_pair,) or (num_pair, width) array
+  if isinstance(data, list):
+    data = np.concatenate(data) if len(data) > 0 else np.zeros(0)
+  data = np.asarray(data, dtype=dtype)
+  if width is None:
+    return data.reshape(num_pair)
+  if width == -1:
+    width = data.size // num_pair if num_pair > 0 else 1
+  return data.reshape(num_pair, width)
+
+
+def gather_range_scores(hoi_scores, hoi_ranges):
+  # (P,C) scores -> the [first, last] hoi classes of every pair's (P,2) hoi_ranges, concatenated pair by pair
+  hoi_ranges = np.asarray(hoi_ranges).reshape(-1, 2)
+  lengths = hoi_ranges[:, 1] - hoi_ranges[:, 0] + 1
+  starts = np.cumsum(lengths) - lengths
+  rows = np.repeat(np.arange(len(lengths)), lengths)
+  cols = np.arange(lengths.sum()) + np.repeat(hoi_ranges[:, 0] - starts, lengths)
+  return hoi_scores[rows, cols]
+
+
+def pack_hoi_results(image_ids, num_pairs, hboxes, oboxes, obj_classes, hoi_scores, hscores, oscores, bin_scores,
+                     num_hoi_class=600, hoi_ranges=None):
+  # pair columns in image order (arrays, or lists of per-image chunks of the images with pairs)
+  # -> results columns. HOI scores are kept as float16, boxes and detection scores untouched.
+  # With the (P,2) [first, last] hoi_ranges of the pairs, hoi_scores are the gather_range_scores slices
+  offsets = np.zeros(len(num_pairs) + 1, dtype=np.int64)
+  offsets[1:] = np.cumsum(num_pairs)
+  num_pair = int(offsets[-1])
+  results = {
+    'image_ids': np.array([int(im_id) for im_id in image_ids], dtype=np.int64),
+    'offsets': offsets,
+    'hboxes': _column(hboxes, num_pair, np.float64, 4),
+    'oboxes': _column(oboxes, num_pair, np.float64, 4),
+    'obj_classes': _column(obj_classes, num_pair, np.int32),
+    'hscores': _column(hscores, num_pair, np.float64),
+    'oscores': _column(oscores, num_pair, np.float64),
+    'bin_scores': _column(bin_scores, num_pair, np.float32, -1),
+  }
+  if hoi_ranges is None:
+    results['hoi_scores'] = _column(hoi_scores, num_pair, np.float16, num_hoi_class)
+    return results
+
+  hoi_ranges = _column(hoi_ranges, num_pair, np.int64, 2)
+  score_offsets = np.zeros(num_pair + 1, dtype=np.int64)
+  score_offsets[1:] = np.cumsum(hoi_ranges[:, 1] - hoi_ranges[:, 0] + 1)
+  results['hoi_scores'] = _column(hoi_scores, int(score_offsets[-1]), np.float16)
+  results['hoi_begins'] = hoi_ranges[:, 0].astype(np.int16)
+  results['hoi_score_offsets'] = score_offsets
+  return results
+
+
+def hoi_results_from_dict(all_results, num_hoi_class=600):
+  # {im_id: [[hbox, obox, obj class, scores, hscore, oscore, bin score], ...]}
+  # (test() output and the old all_hoi_detections.pkl) -> results columns
+  image_ids = list(all_results.keys())
+  num_pairs = [len(all_results[im_id]) for im_id in image_ids]
+  entries = [entry for im_id in image_ids for entry in all_results[im_id]]
+  columns = [np.array([entry[i] for entry in entries]) for i in range(7)]
+  return pack_hoi_results(image_ids, num_pairs, *columns, num_hoi_class=num_hoi_class)
+
+
+def save_hoi_results(results, save_dir):
+  # <field>.npy for every column + manifest.json, the manifest is written last
+  # so an interrupted save is never picked up
+  if not os.path.exists(save_dir):
+    os.makedirs(save_dir)
+
+  fields = RESULT_FIELDS
+  if 'hoi_begins' in results:
+    fields += RANGE_FIELDS
+  manifest = {}
+  for field in fields:
+    data = np.asarray(results[field])
+    file_name = '%s.npy' % field
+    tmp_path = os.path.join(save_dir, file_name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+      np.save(f, data)
+    os.rename(tmp_path, os.path.join(save_dir, file_name))
+    manifest[field] = {
+      'file': file_name,
+      'dtype': data.dtype.str,
+      'shape': list(data.shape),
+    }
+
+  manifest_path = os.path.join(save_dir, 'manifest.json')
+  with open(manifest_path + '.tmp', 'w') as f:
+    json.dump(manifest, f, indent=2, sort_keys=True)
+  os.rename(manifest_path + '.tmp', manifest_path)
+
+
+def hoi_results_exist(path):
+  if os.path.isdir(path):
+    return os.path.exists(os.path.join(path, 'manifest.json'))
+  return os.path.exists(path)
+
+
+def load_hoi_results(path):
+  # a results directory is opened with mmap_mode='r', an old all_hoi_detections.pkl
+  # is converted to the same columns in memory
+  if not os.path.isdir(path):
+    with open(path, 'rb') as f:
+      return hoi_results_from_dict(pickle.load(f))
+
+  with open(os.path.join(path, 'manifest.json')) as f:
+    manifest = json.load(f)
+  results = {}
+  for field, info in manifest.items():
+    data = np.load(os.path.join(path, info['file']), mmap_mode='r')
+    assert list(data.shape) == info['shape'], 'stale column %s' % info['file']
+    results[field] = data
+  return results
+
+
+def hoi_score_columns(results, rows, first, last):
+  # (len(rows), last-first+1) scores of the hoi classes first..last of the pairs rows,
+  # zero where a range-sparse store has none
+  rows = np.asarray(rows, dtype=np.int64)
+  if 'hoi_begins' not in results:
+    return np.asarray(results['hoi_scores'][rows, first:last + 1])
+  score_offsets = np.asarray(results['hoi_score_offsets'])
+  starts = score_offsets[rows]
+  lengths = score_offsets[rows + 1] - starts
+  cols = np.arange(first, last + 1)[np.newaxis, :] - np.asarray(results['hoi_begins'])[rows][:, np.newaxis]
+  valid = (cols >= 0) & (cols < lengths[:, np.newaxis])
+  scores = np.zeros(cols.shape, dtype=np.float16)
+  scores[valid] = results['hoi_scores'][(starts[:, np.newaxis] + cols)[valid]]
+  return scores
+
+
+def dense_hoi_scores(results, start, end, num_hoi_class=600):
+  # (end-start, num_hoi_class) scores of the pairs start:end, zero outside the stored ranges
+  return hoi_score_columns(results, np.arange(start, end), 0, num_hoi_class - 1)
+
+
+def iter_image_detections(results, num_hoi_class=600):
+  # (im_id, entries) per image, entries laid out like the lists of the old results dict
+  fields = ('hboxes', 'oboxes', 'obj_classes', 'hscores', 'oscores', 'bin_scores')
+  offsets = results['offsets']
+  for k, im_id in enumerate(results['image_ids']):
+    start, end = offsets[k], offsets[k + 1]
+    im_columns = [np.asarray(results[field][start:end]) for field in fields]
+    im_columns.insert(3, dense_hoi_scores(results, start, end, num_hoi_class))
+    yield im_id, list(zip(*im_columns))
@@ -38,13 +38,16 @@ def get_minibatch(roidb, num_classes):
   hboxes = roidb[0]['hboxes'] * im_scales[0]
   oboxes = roidb[0]['oboxes'] * im_scales[0]
   iboxes = roidb[0]['iboxes'] * im_scales[0]
-  hoi_classes = roidb[0]['hoi_classes']
+  # hoi classes in CSR layout and 0/1 binary labels, densified by roibatchLoader
+  hoi_class_inds = roidb[0]['hoi_class_inds']
+  hoi_class_offsets = roidb[0]['hoi_class_offsets']
   bin_classes = roidb[0]['bin_classes']
 
   blobs['hboxes'] = hboxes
   blobs['oboxes'] = oboxes
   blobs['iboxes'] = iboxes
-  blobs['hoi_classes'] = hoi_classes
+  blobs['hoi_class_inds'] = hoi_class_inds
+  blobs['hoi_class_offsets'] = hoi_class_offsets
   blobs['bin_classes'] = bin_classes
   blobs['im_info'] = np.array(
     [[im_blob.shape[1], im_blob.shape[2], im_scales[0]]],
@@ -106,6 +106,103 @@ def gen_spatial_map(human_box, object_box):
     return spa_map
 
 
+def bbox_trans_batch(human_boxes, object_boxes, size=64):
+    """Vectorized `bbox_trans` over (N,4) box arrays. Returns two (N,4) arrays of rounded coordinates."""
+    human_box = np.array(human_boxes).reshape(-1, 4)
+    object_box = np.array(object_boxes).reshape(-1, 4)
+    dtype = np.result_type(human_box.dtype, object_box.dtype)
+    if not np.issubdtype(dtype, np.floating):
+        dtype = np.float64
+    human_box = human_box.astype(dtype)
+    object_box = object_box.astype(dtype)
+
+    union_box = np.concatenate((np.minimum(human_box[:, :2], object_box[:, :2]),
+                                np.maximum(human_box[:, 2:], object_box[:, 2:])), axis=1)
+
+    height = union_box[:, 3] - union_box[:, 1] + 1
+    width = union_box[:, 2] - union_box[:, 0] + 1
+    ratio_height = height > width
+    scale = np.where(ratio_height, height, width)
+
+    # shift the top-left corner to (0,0)
+    human_box -= union_box[:, [0, 1, 0, 1]]
+    object_box -= union_box[:, [0, 1, 0, 1]]
+
+    # the longer side is mapped onto [0, size - 1]
+    x_max = np.where(ratio_height, size * width / height - 1, size - 1)
+    y_max = np.where(ratio_height, size - 1, size * height / width - 1)
+    for box in (human_box, object_box):
+        box[:, 0] = 0 + size * box[:, 0] / scale
+        box[:, 1] = 0 + size * box[:, 1] / scale
+        box[:, 2] = x_max - size * (width - 1 - box[:, 2]) / scale
+        box[:, 3] = y_max - size * (height - 1 - box[:, 3]) / scale
+
+    # center the shorter side
+    union_max = np.where(ratio_height,
+                         np.maximum(human_box[:, 2], object_box[:, 2]),
+                         np.maximum(human_box[:, 3], object_box[:, 3]))
+    shift = size / 2 - (union_max + 1) / 2
+
+    human_longer = np.where(ratio_height, human_box[:, 3] > object_box[:, 3], human_box[:, 2] > object_box[:, 2])
+    human_box[ratio_height & human_longer, 3] = size - 1
+    object_box[ratio_height & ~human_longer, 3] = size - 1
+    human_box[~ratio_height & human_longer, 2] = size - 1
+    object_box[~ratio_height & ~human_longer, 2] = size - 1
+
+    # bbox_trans adds the shift in float64 and only writes it back to the box dtype on the
+    # 'height' branch, so the rounding below has to follow the same precision per pair
+    shift_mask = np.where(ratio_height[:, np.newaxis], [1, 0, 1, 0], [0, 1, 0, 1])
+    outputs = []
+    for box in (human_box, object_box):
+        shifted = box.astype(np.float64) + shift_mask * shift.astype(np.float64)[:, np.newaxis]
+        outputs.append(np.where(ratio_height[:, np.newaxis],
+                                np.round(shifted.astype(dtype)),
+                                np.round(shifted)))
+    return outputs[0], outputs[1]
+
+
+def _slice_bounds(inds, size):
+    # python slice semantics: negative indices count from the end, then clip to [0, size]
+    inds = np.where(inds < 0, inds + size, inds)
+    return np.clip(inds, 0, size)
+
+
+def gen_spatial_maps_batch(hboxes, oboxes, size=64):
+    """Rasterize N human-object pairs into a (N,2,size,size) float32 array, identical to `gen_spatial_map`."""
+    hbox, obox = bbox_trans_batch(hboxes, oboxes, size)
+    boxes = np.stack((hbox, obox), axis=1).astype(np.int64)
+    coords = np.arange(size)
+
+    x1 = _slice_bounds(boxes[:, :, 0], size)[:, :, np.newaxis]
+    y1 = _slice_bounds(boxes[:, :, 1], size)[:, :, np.newaxis]
+    x2 = _slice_bounds(boxes[:, :, 2] + 1, size)[:, :, np.newaxis]
+    y2 = _slice_bounds(boxes[:, :, 3] + 1, size)[:, :, np.newaxis]
+    rows = (coords >= y1) & (coords < y2)
+    cols = (coords >= x1) & (coords < x2)
+    return (rows[:, :, :, np.newaxis] & cols[:, :, np.newaxis, :]).astype('float32')
+
+
+def sample_hoi_negatives(bin_classes, neg_ratio):
+  # all positive pairs + neg_ratio negatives per positive, drawn without replacement
+  # and cycling through the negatives when there are too few
+  pos_inds = np.nonzero(bin_classes == 0)[0]
+  neg_inds = np.nonzero(bin_classes == 1)[0]
+  num_neg = int(round(len(pos_inds) * neg_ratio)) if len(neg_inds) > 0 else 0
+  neg_inds = np.resize(np.random.permutation(neg_inds), num_neg)
+  return np.concatenate((pos_inds, neg_inds))
+
+
+def hoi_multi_hot(class_inds, class_offsets, rows, num_classes):
+  # (len(rows), num_classes) multi-hot hoi classes of the selected pairs of the CSR layout
+  stts = class_offsets[rows]
+  lengths = class_offsets[rows + 1] - stts
+  batch_rows = np.repeat(np.arange(len(rows)), lengths)
+  positions = np.arange(lengths.sum()) + np.repeat(stts - (np.cumsum(lengths) - lengths), lengths)
+  multi_hot = np.zeros((len(rows), num_classes))
+  multi_hot[batch_rows, class_inds[positions]] = 1
+  return multi_hot
+
+
 class roibatchLoader(data.Dataset):
   def __init__(self, roidb, ratio_list, ratio_index, batch_size, num_classes, training=True, normalize=None):
     self._roidb = roidb
@@ -156,15 +253,19 @@ class roibatchLoader(data.Dataset):
     # we need to random shuffle the bounding box.
     data_height, data_width = data.size(1), data.size(2)
 
-    hoi_inds = np.array(range(len(blobs['hboxes'])))
+    if self.training:
+      hoi_inds = sample_hoi_negatives(blobs['bin_classes'], cfg.TRAIN.HOI_NEG_RATIO)
+    else:
+      hoi_inds = np.array(range(len(blobs['hboxes'])))
     np.random.shuffle(hoi_inds)
     num_hoi = len(hoi_inds)
 
     blobs['hboxes'] = blobs['hboxes'][hoi_inds]
     blobs['oboxes'] = blobs['oboxes'][hoi_inds]
     blobs['iboxes'] = blobs['iboxes'][hoi_inds]
-    blobs['hoi_classes'] = blobs['hoi_classes'][hoi_inds]
-    blobs['bin_classes'] = blobs['bin_classes'][hoi_inds]
+    blobs['hoi_classes'] = hoi_multi_hot(blobs['hoi_class_inds'], blobs['hoi_class_offsets'],
+                                         hoi_inds, self._num_classes)
+    blobs['bin_classes'] = np.eye(2)[blobs['bin_classes'][hoi_inds]]
 
     gt_boxes = np.concatenate((blobs['hboxes'], blobs['oboxes'], blobs['iboxes']))
     gt_boxes = torch.from_numpy(gt_boxes)
@@ -175,11 +276,15 @@ class roibatchLoader(data.Dataset):
     gt_binaries = np.tile(blobs['bin_classes'], (3, 1))
     gt_binaries = torch.from_numpy(gt_binaries)
 
-    raw_spa_maps = np.zeros((num_hoi, 2, 64, 64))
-    for i in range(num_hoi):
-        raw_spa_maps[i] = gen_spatial_map(blobs['hboxes'][i], blobs['oboxes'][i])
-    raw_spa_maps = np.tile(raw_spa_maps, (3, 1, 1, 1))
-    gt_spa_maps = torch.from_numpy(raw_spa_maps).float()
+    if cfg.SPA_MAP_IN_MODEL:
+        # the boxes gen_spatial_maps_batch would get, in their dtype, the network rasterizes them
+        raw_spa_maps = np.concatenate((blobs['hboxes'], blobs['oboxes']), axis=1)[:, np.newaxis, np.newaxis, :]
+        raw_spa_maps = np.tile(raw_spa_maps, (3, 1, 1, 1))
+        gt_spa_maps = torch.from_numpy(raw_spa_maps)
+    else:
+        raw_spa_maps = gen_spatial_maps_batch(blobs['hboxes'], blobs['oboxes'])
+        raw_spa_maps = np.tile(raw_spa_maps, (3, 1, 1, 1))
+        gt_spa_maps = torch.from_numpy(raw_spa_maps).float()
 
     ########################################################
     # padding the input image to fixed size for each group #
@@ -328,7 +433,10 @@ class roibatchLoader(data.Dataset):
         iboxes_padding = torch.FloatTensor(1, gt_boxes.size(1)).zero_()
         hoi_classes_padding = torch.FloatTensor(1, gt_classes.size(1)).zero_()
         bin_classes_padding = torch.LongTensor(1).zero_()
-        spa_maps_padding = torch.LongTensor(1, 2, 64, 64).zero_()
+        if cfg.SPA_MAP_IN_MODEL:
+            spa_maps_padding = torch.zeros((1, 1, 1, 8), dtype=gt_spa_maps.dtype)
+        else:
+            spa_maps_padding = torch.LongTensor(1, 2, 64, 64).zero_()
         num_boxes = 0
 
         # permute trim_data to adapt to downstream processing
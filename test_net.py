@@ -26,7 +26,9 @@ import torchvision.transforms as transforms
 import torchvision.datasets as dset
 from scipy.misc import imread
 from roi_data_layer.roidb import combined_roidb
-from roi_data_layer.roibatchLoader import roibatchLoader, gen_spatial_map
+from roi_data_layer.roibatchLoader import roibatchLoader, gen_spatial_maps_batch
+from roi_data_layer.hoi_pairs import detections_to_arrays, candidate_pairs
+from roi_data_layer.hoi_results import pack_hoi_results, save_hoi_results, hoi_results_exist, gather_range_scores
 from model.utils.config import cfg, cfg_from_file, cfg_from_list, get_output_dir
 from model.rpn.bbox_transform import clip_boxes
 from model.nms.nms_wrapper import nms
@@ -35,7 +37,7 @@ from model.utils.net_utils import save_net, load_net, vis_detections
 from model.utils.blob import im_list_to_blob
 from model.faster_rcnn.vgg16 import vgg16
 from model.faster_rcnn.resnet import resnet
-from generate_HICO_detection import generate_HICO_detection
+from generate_HICO_detection import eval_HICO_results, hoi_range
 import pdb
 
 try:
@@ -89,6 +91,12 @@ def parse_args():
   parser.add_argument('--checkpoint', dest='checkpoint',
                       help='checkpoint to load network',
                       default=75265, type=int)
+  parser.add_argument('--export_workers', dest='export_workers',
+                      help='processes writing the detections_XX.mat files, 0: main process only',
+                      default=0, type=int)
+  parser.add_argument('--export_mat', dest='export_mat',
+                      help='write the detections_XX.mat files for submission',
+                      action='store_true')
 
 
   args = parser.parse_args()
@@ -148,12 +156,11 @@ if __name__ == '__main__':
   pprint.pprint(cfg)
   np.random.seed(cfg.RNG_SEED)
 
-  output_path = os.path.join(args.output_dir, 'all_hoi_detections.pkl')
-  if os.path.exists(output_path):
+  output_path = os.path.join(args.output_dir, 'all_hoi_detections')
+  if hoi_results_exist(output_path):
       print('Test results found!')
-      generate_HICO_detection(output_path, 'output/results', 1.0, 0.0)
-      os.chdir('benchmark')
-      os.system('matlab -nodesktop -nosplash -r "Generate_detection ' + '../output/results/' + '/;quit;"')
+      eval_HICO_results(output_path, [(1.0, 0.0)], HICO_dirs=['output/results'], export_mat=args.export_mat,
+                        num_workers=args.export_workers)
       exit(0)
 
   print('Loading object detections ...')
@@ -246,9 +253,19 @@ if __name__ == '__main__':
   num_images = len(det_db)
   print('Loaded Photo: {} images.'.format(num_images))
 
-  all_results = {}
+  # columns of the results store, filled per image with pairs, see roi_data_layer.hoi_results
+  image_ids = list(det_db.keys())
+  num_pairs = []
+  all_hboxes = []
+  all_oboxes = []
+  all_obj_classes = []
+  all_hoi_scores = []
+  all_hscores = []
+  all_oscores = []
+  all_bin_scores = []
+  all_hoi_ranges = [] if cfg.TEST.RANGE_HOI_RESULTS else None
   image_path_template = 'data/hico/images/test2015/HICO_test2015_%s.jpg'
-  for i, im_id in enumerate(det_db):
+  for i, im_id in enumerate(image_ids):
       print('test [%d/%d]' % (i + 1, num_images))
       im_file = image_path_template % str(im_id).zfill(8)
       im_in = np.array(imread(im_file))
@@ -259,50 +276,28 @@ if __name__ == '__main__':
       im = im_in
       blobs, im_scales = _get_image_blob(im)
 
-      hboxes_raw = np.zeros((0, 4))
-      oboxes_raw = np.zeros((0, 4))
-      iboxes_raw = np.zeros((0, 4))
-      spa_maps_raw = np.zeros((0, 2, 64, 64))
-      obj_classes = []
-      hscores = []
-      oscores = []
-
-      num_cand = 0
-      im_results = []
-      for human_det in det_db[im_id]:
-          if (np.max(human_det[5]) > human_thres) and (human_det[1] == 'Human'):
-              # This is a valid human
-              hbox = np.array([human_det[2][0],
-                               human_det[2][1],
-                               human_det[2][2],
-                               human_det[2][3]]).reshape(1, 4)
-
-              for object_det in det_db[im_id]:
-                  if (np.max(object_det[5]) > object_thres) and not (np.all(object_det[2] == human_det[2])):
-                      # This is a valid object
-                      obox = np.array([object_det[2][0],
-                                       object_det[2][1],
-                                       object_det[2][2],
-                                       object_det[2][3]]).reshape(1, 4)
-
-                      ibox = np.array([min(hbox[0, 0], obox[0, 0]),
-                                       min(hbox[0, 1], obox[0, 1]),
-                                       max(hbox[0, 2], obox[0, 2]),
-                                       max(hbox[0, 3], obox[0, 3])]).reshape(1, 4)
-                      spa_map_raw = gen_spatial_map(human_det[2], object_det[2])
-                      spa_map_raw = spa_map_raw[np.newaxis, : ,: ,:]
-                      spa_maps_raw = np.concatenate((spa_maps_raw, spa_map_raw))
-                      hboxes_raw = np.concatenate((hboxes_raw, hbox))
-                      oboxes_raw = np.concatenate((oboxes_raw, obox))
-                      iboxes_raw = np.concatenate((iboxes_raw, ibox))
-                      obj_classes.append(object_det[4])
-                      hscores.append(human_det[5])
-                      oscores.append(object_det[5])
-                      num_cand += 1
+      im_obj_dets = det_db[im_id]
+      boxes, max_scores, is_human = detections_to_arrays(im_obj_dets)
+      pair_hum_inds, pair_obj_inds = candidate_pairs(boxes, max_scores, is_human, human_thres, object_thres)
+      num_cand = len(pair_hum_inds)
+      num_pairs.append(num_cand)
       if num_cand == 0:
-          all_results[im_id] = im_results
           continue
 
+      hboxes_raw = boxes[pair_hum_inds].astype(np.float64)
+      oboxes_raw = boxes[pair_obj_inds].astype(np.float64)
+      iboxes_raw = np.concatenate((np.minimum(hboxes_raw[:, :2], oboxes_raw[:, :2]),
+                                   np.maximum(hboxes_raw[:, 2:], oboxes_raw[:, 2:])), axis=1)
+      obj_classes = [im_obj_dets[j][4] for j in pair_obj_inds]
+      hscores = [im_obj_dets[j][5] for j in pair_hum_inds]
+      oscores = [im_obj_dets[j][5] for j in pair_obj_inds]
+
+      if cfg.SPA_MAP_IN_MODEL:
+          # the unscaled boxes, in their dtype, the network rasterizes them
+          spa_maps_raw = np.concatenate((boxes[pair_hum_inds], boxes[pair_obj_inds]), axis=1)
+          spa_maps_raw = spa_maps_raw[:, np.newaxis, np.newaxis, :]
+      else:
+          spa_maps_raw = gen_spatial_maps_batch(boxes[pair_hum_inds], boxes[pair_obj_inds])
       hboxes_raw = hboxes_raw[np.newaxis, :, :]
       oboxes_raw = oboxes_raw[np.newaxis, :, :]
       iboxes_raw = iboxes_raw[np.newaxis, :, :]
@@ -316,7 +311,11 @@ if __name__ == '__main__':
       hboxes.data.resize_(hboxes_t.size()).copy_(hboxes_t)
       oboxes.data.resize_(oboxes_t.size()).copy_(oboxes_t)
       iboxes.data.resize_(iboxes_t.size()).copy_(iboxes_t)
-      spa_maps.data.resize_(spa_maps_t.size()).copy_(spa_maps_t)
+      if cfg.SPA_MAP_IN_MODEL:
+        # keep the dtype of the boxes, the rasterizer rounds like bbox_trans does on them
+        spa_maps.data = spa_maps_t.to(spa_maps.data.device)
+      else:
+        spa_maps.data.resize_(spa_maps_t.size()).copy_(spa_maps_t)
 
       assert len(im_scales) == 1, "Only single-image batch implemented"
       im_blob = blobs
@@ -335,27 +334,29 @@ if __name__ == '__main__':
           hoi_prob, bin_prob, RCNN_loss_cls, RCNN_loss_bin = \
               fasterRCNN(im_data, im_info, hboxes, oboxes, iboxes, hoi_classes, bin_classes, spa_maps, num_hois)
 
-      for j in range(num_cand):
-          temp = []
-          temp.append(hboxes_raw[0, j])  # Human box
-          temp.append(oboxes_raw[0, j])  # Object box
-          temp.append(obj_classes[j])  # Object class
-          temp.append(hoi_prob.cpu().data.numpy()[0, j].tolist())  # Score (600)
-          temp.append(hscores[j])  # Human score
-          temp.append(oscores[j])  # Object score
-          temp.append(bin_prob.cpu().data.numpy()[0, j].tolist())  # binary score
-          im_results.append(temp)
-
-      all_results[im_id] = im_results
+      all_hboxes.append(hboxes_raw[0])  # Human box
+      all_oboxes.append(oboxes_raw[0])  # Object box
+      all_obj_classes.append(obj_classes)  # Object class
+      im_hoi_scores = hoi_prob.cpu().data.numpy()[0]
+      if all_hoi_ranges is not None:
+        # [first, last] hoi classes of the object class, 0-based
+        im_hoi_ranges = np.array(hoi_range)[np.array(obj_classes) - 1] - 1
+        im_hoi_scores = gather_range_scores(im_hoi_scores, im_hoi_ranges)
+        all_hoi_ranges.append(im_hoi_ranges)
+      all_hoi_scores.append(im_hoi_scores.astype(np.float16))  # Score (600, or the object's range)
+      all_hscores.append(hscores)  # Human score
+      all_oscores.append(oscores)  # Object score
+      all_bin_scores.append(bin_prob.cpu().data.numpy()[0])  # binary score
 
   if not os.path.exists(args.output_dir):
       os.mkdir(args.output_dir)
 
   print('Saving results ...')
-  with open(output_path, 'wb') as f:
-      pickle.dump(all_results, f)
-
-  generate_HICO_detection(output_path, 'output/results', 1.0, 0.0)
-
-  os.chdir('benchmark')
-  os.system('matlab -nodesktop -nosplash -r "Generate_detection ' + '../output/results/' + '/;quit;"')
+  results = pack_hoi_results(image_ids, num_pairs, all_hboxes, all_oboxes, all_obj_classes, all_hoi_scores,
+                             all_hscores, all_oscores, all_bin_scores, hoi_ranges=all_hoi_ranges)
+  save_hoi_results(results, output_path)
+
+  # eval_result.txt, and the detections_XX.mat for submission: from the same pass, or by export_workers
+  # processes reading the saved results
+  eval_HICO_results(output_path if args.export_mat and args.export_workers > 0 else results, [(1.0, 0.0)],
+                    HICO_dirs=['output/results'], export_mat=args.export_mat, num_workers=args.export_workers)
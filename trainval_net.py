@@ -329,7 +329,11 @@ if __name__ == '__main__':
       iboxes.data.resize_(data[4].size()).copy_(data[4])
       hoi_classes.resize_(data[5].size()).copy_(data[5])
       bin_classes.resize_(data[6].size()).copy_(data[6])
-      spa_maps.data.resize_(data[7].size()).copy_(data[7])
+      if cfg.SPA_MAP_IN_MODEL:
+        # keep the dtype of the boxes, the rasterizer rounds like bbox_trans does on them
+        spa_maps.data = data[7].to(spa_maps.data.device)
+      else:
+        spa_maps.data.resize_(data[7].size()).copy_(data[7])
       num_hois.data.resize_(data[8].size()).copy_(data[8])
 
       if num_hois.data.item() == 0: